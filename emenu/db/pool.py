@@ -0,0 +1,204 @@
+"""
+A process-local pool of database connections.
+
+Django closes the connection of a thread at the end of every request (with
+CONN_MAX_AGE=0), and Celery closes it around every task. The pooled database
+backend hands the closed connections back to the pool instead, and the next
+request or task of the process takes one of them, after a health check.
+"""
+from contextlib import closing
+import os
+import threading
+import time
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Pools inherited from the parent process. Their connections share the sockets
+# of the parent, so they are neither used nor closed, only kept referenced.
+_inherited_pools = []
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Keep at most 'max_size' connections to a single database, checked out or idle.
+    Idle connections are closed after 'idle_timeout' seconds, and a checkout waits
+    up to 'timeout' seconds for a free connection when all of them are in use.
+    """
+
+    def __init__(self, max_size=10, idle_timeout=300, timeout=30):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._condition = threading.Condition()
+        # (connection, released_at) pairs, the most recently released last.
+        self._idle = []
+        self._checked_out = set()
+        # Slots reserved for the connections being opened.
+        self._opening = 0
+        self._closed = False
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._checked_out) + self._opening
+
+    def acquire(self, connect, is_usable):
+        """
+        Return an idle connection which passes the 'is_usable' check,
+        or a new one opened by 'connect'.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                connection = self._take(deadline)
+            if connection is None:
+                break
+            if is_usable(connection):
+                return connection
+            self.discard(connection)
+
+        try:
+            connection = connect()
+        except BaseException:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self._checked_out.add(connection)
+        return connection
+
+    def _take(self, deadline):
+        """
+        Take the most recently used idle connection, or reserve a slot
+        for a new one and return None.
+        """
+        while True:
+            self._close_expired()
+            if self._idle:
+                connection, _ = self._idle.pop()
+                self._checked_out.add(connection)
+                return connection
+            if self.size < self.max_size:
+                self._opening += 1
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PoolTimeout(
+                    f'All {self.max_size} database connections are in use.')
+            self._condition.wait(remaining)
+
+    def _close_expired(self):
+        expired_before = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] <= expired_before:
+            connection, _ = self._idle.pop(0)
+            _close_quietly(connection)
+
+    def release(self, connection):
+        """
+        Roll back whatever the connection left open and return it to the pool.
+        """
+        if self.pid != os.getpid() or connection not in self._checked_out:
+            # Not handed out by this pool in this process, e.g. before a fork.
+            return
+        if self._closed:
+            self.discard(connection)
+            return
+        try:
+            connection.rollback()
+        except Exception:
+            self.discard(connection)
+            return
+        with self._condition:
+            self._checked_out.discard(connection)
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def discard(self, connection):
+        with self._condition:
+            self._checked_out.discard(connection)
+            self._condition.notify()
+        _close_quietly(connection)
+
+    def close(self):
+        """
+        Close the idle connections. The checked out ones are closed when released.
+        """
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._closed = True
+        for connection, _ in idle:
+            _close_quietly(connection)
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def get_pool(key, max_size=10, idle_timeout=300, timeout=30):
+    """
+    Return the pool of this process for the given key, creating it on first use.
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.pid != os.getpid():
+            _inherited_pools.append(pool)
+            pool = None
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(max_size, idle_timeout, timeout)
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = [pool for pool in _pools.values() if pool.pid == os.getpid()]
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Take the connections of a DatabaseWrapper from a pool, and return them on close().
+
+    The pool is configured by the 'POOL' dictionary of the database settings,
+    with the optional 'MAX_SIZE', 'IDLE_TIMEOUT' and 'TIMEOUT' (in seconds) keys.
+    Set 'CONN_MAX_AGE' to 0, so that every request and task returns its connection.
+    """
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get('POOL', {})
+        # The database of an alias changes in tests, so the pools are per connection parameters.
+        self.pool = get_pool(
+            (self.alias, repr(sorted(conn_params.items()))),
+            max_size=options.get('MAX_SIZE', 10),
+            idle_timeout=options.get('IDLE_TIMEOUT', 300),
+            timeout=options.get('TIMEOUT', 30),
+        )
+        connect = super().get_new_connection
+        try:
+            return self.pool.acquire(lambda: connect(conn_params), self.is_pooled_connection_usable)
+        except PoolTimeout as e:
+            raise self.Database.OperationalError(str(e)) from e
+
+    def is_pooled_connection_usable(self, connection):
+        try:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+        except self.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
@@ -0,0 +1,16 @@
+from django.db.backends.postgresql import base, creation
+from emenu.db.pool import PooledDatabaseWrapperMixin, close_pools
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # PostgreSQL refuses to drop a database with open connections, idle ones included.
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """
+    The PostgreSQL backend with pooled connections, see PooledDatabaseWrapperMixin.
+    """
+    creation_class = DatabaseCreation
@@ -0,0 +1,86 @@
+"""
+Routing of the public read traffic to the read replicas.
+
+ReplicaRoutingMiddleware turns the replicas on for the safe requests to the views
+with 'read_from_replicas' set, and ReplicaRouter then sends their reads to one of
+DATABASE_REPLICAS. Everything else, writes included, goes to the primary database.
+
+A replica lags behind the primary, so a client which wrote something is pinned to
+the primary for REPLICA_PIN_SECONDS afterwards, to read its own writes.
+"""
+from asgiref.local import Local
+from contextlib import contextmanager
+from django.conf import settings
+import random
+
+PIN_COOKIE = 'emenu_pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = Local()
+
+
+def reset_routing():
+    _state.use_replicas = False
+    _state.wrote = False
+
+
+def has_written():
+    return getattr(_state, 'wrote', False)
+
+
+@contextmanager
+def read_primary():
+    """
+    Send the reads of the block to the primary database, e.g. to fill a cache,
+    which must not keep the data of a lagging replica.
+    """
+    use_replicas = getattr(_state, 'use_replicas', False)
+    _state.use_replicas = False
+    try:
+        yield
+    finally:
+        _state.use_replicas = use_replicas
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Once the request writes, it reads the primary, which has its writes.
+        if settings.DATABASE_REPLICAS and getattr(_state, 'use_replicas', False) and not has_written():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary.
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Read the replicas in the safe requests to the views which allow it, unless the
+    client is pinned to the primary. Pin the client when the request writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reset_routing()
+        try:
+            response = self.get_response(request)
+            if settings.DATABASE_REPLICAS and (request.method not in SAFE_METHODS or has_written()):
+                response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                    httponly=True, samesite='Lax')
+            return response
+        finally:
+            reset_routing()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # DRF views keep their class in 'cls', Django class-based views in 'view_class'.
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        _state.use_replicas = (request.method in SAFE_METHODS
+                               and getattr(view_class, 'read_from_replicas', False)
+                               and PIN_COOKIE not in request.COOKIES)
@@ -1,13 +1,81 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 from emenu.menu.models import Dish, Menu
+from emenu.menu.search import search
 
 
-class DishAdmin(admin.ModelAdmin):
-    pass
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which takes the number of rows of an unfiltered PostgreSQL table
+    from the planner statistics, instead of counting all of them.
+    """
 
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            # The statistics are missing until the table is first analyzed.
+            if row is not None and row[0] > 0:
+                return int(row[0])
+        return super().count
 
-class MenuAdmin(admin.ModelAdmin):
-    pass
+
+class CatalogModelAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin for the tables that grow large. The search goes through the full-text
+    indexes of emenu.menu.search, and with ADMIN_FULL_COUNTS off the changelists
+    neither count the whole table nor show the total next to the search results.
+    The 'search_fields' only turn on the search box and the autocomplete.
+    """
+    search_fields = ['name', 'description']
+
+    @property
+    def show_full_result_count(self):
+        return settings.ADMIN_FULL_COUNTS
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if not settings.ADMIN_FULL_COUNTS:
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        # The changelist orders the results itself, the autocomplete keeps the relevance order.
+        return search(queryset, search_term, prefix=True).order_by('-rank', 'pk'), False
+
+
+class DishAdmin(CatalogModelAdmin):
+    list_display = ['name', 'price', 'preparation_time', 'is_vegan', 'menu_count', 'date_modified']
+    list_filter = ['is_vegan']
+
+    def get_queryset(self, request):
+        # A correlated subquery, so that only the dishes of the page are counted.
+        menu_counts = Menu.dishes.through.objects.filter(dish_id=OuterRef('pk')).order_by().values(
+            'dish_id').annotate(count=Count('menu_id')).values('count')
+        return super().get_queryset(request).annotate(
+            menu_count=Coalesce(Subquery(menu_counts), 0))
+
+    @admin.display(description='menus')
+    def menu_count(self, dish):
+        return dish.menu_count
+
+
+class MenuAdmin(CatalogModelAdmin):
+    # The dish counts are kept in the menus by the signal handlers.
+    list_display = ['name', 'dish_count', 'date_added', 'date_modified']
+    # The dishes are searched on demand, instead of rendering all of them into the form.
+    autocomplete_fields = ['dishes']
 
 
 admin.site.register(Dish, DishAdmin)
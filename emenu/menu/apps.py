@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MenuConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'emenu.menu'
+
+    def ready(self):
+        from emenu.menu import checks, signals  # noqa: F401
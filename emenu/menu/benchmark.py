@@ -0,0 +1,271 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Prefetch
+from django.test import Client, override_settings
+from django.urls import reverse
+from emenu.menu.cache import get_cache
+from emenu.menu.changes import get_latest_change_id, log_changes
+from emenu.menu.models import Change, Dish, Menu
+from emenu.menu.renderers import FastJSONRenderer, MessagePackRenderer, msgpack
+from emenu.menu.serializers import PublicMenuDetailSerializer
+from emenu.menu.snapshots import build_snapshots
+from emenu.menu.tasks import get_new_dishes_mail_contents
+from rest_framework.renderers import JSONRenderer
+import itertools
+import random
+import statistics
+import time
+import tracemalloc
+
+
+def generate_data(seed, menus, dishes, menu_size, users):
+    """
+    Fill the database with synthetic menus, dishes and users.
+    The same seed and sizes always produce the same data.
+    """
+    rng = random.Random(seed)
+    Dish.objects.bulk_create([
+        Dish(name=f'Benchmark dish {i}',
+             description=f'Synthetic dish number {i}.',
+             price=Decimal(rng.randint(100, 10000)) / 100,
+             preparation_time=timedelta(minutes=rng.randint(1, 90)),
+             is_vegan=rng.random() < 0.3)
+        for i in range(dishes)
+    ], batch_size=500)
+    Menu.objects.bulk_create([
+        Menu(name=f'Benchmark menu {i}',
+             description=f'Synthetic menu number {i}.')
+        for i in range(menus)
+    ], batch_size=500)
+    User.objects.bulk_create([
+        User(username=f'benchmark-user-{i}', first_name=f'User {i}',
+             email=f'benchmark-user-{i}@example.com')
+        for i in range(users)
+    ], batch_size=500)
+
+    # SQLite does not return primary keys from bulk_create(), so read them back.
+    dish_pks = list(Dish.objects.filter(
+        name__startswith='Benchmark dish ').order_by('pk').values_list('pk', flat=True))
+    menu_pks = list(Menu.objects.filter(
+        name__startswith='Benchmark menu ').order_by('pk').values_list('pk', flat=True))
+    Menu.dishes.through.objects.bulk_create([
+        Menu.dishes.through(menu_id=menu_pk, dish_id=dish_pk)
+        for menu_pk in menu_pks
+        for dish_pk in rng.sample(dish_pks, min(menu_size, len(dish_pks)))
+    ], batch_size=500)
+    Menu.objects.filter(pk__in=menu_pks).update_dish_counts()
+    if settings.PUBLIC_MENU_SNAPSHOTS:
+        build_snapshots(menu_pks)
+
+    # Make a tenth of the dishes show up in the daily digest, and the menus in the change feed.
+    log_changes(Change.DISH, Change.CREATED, dish_pks[::10])
+    log_changes(Change.MENU, Change.CREATED, menu_pks)
+    return menu_pks, dish_pks
+
+
+def get_endpoints(menu_pk, dish_pk):
+    """
+    Return a list of (name, url, needs_login) of the API endpoints to measure.
+    """
+    return [
+        ('root', reverse('root'), False),
+        ('public-menu-list', reverse('public-menu-list'), False),
+        ('public-menu-detail', reverse('public-menu-detail', kwargs={'pk': menu_pk}), False),
+        ('public-menu-search', reverse('public-menu-search-list') + '?q=synthetic+menu', False),
+        ('public-dish-search', reverse('public-dish-search-list') + '?q=synthetic+dish', False),
+        ('public-menu-changes', reverse('public-menu-changes-list') + '?since=0', False),
+        ('private-menu-list', reverse('private-menu-list'), True),
+        ('private-menu-detail', reverse('private-menu-detail', kwargs={'pk': menu_pk}), True),
+        ('dish-list', reverse('dish-list'), True),
+        ('dish-detail', reverse('dish-detail', kwargs={'pk': dish_pk}), True),
+        ('catalog-export', reverse('catalog-export'), True),
+        ('openapi-schema', reverse('openapi-schema'), False),
+        ('swagger-ui', reverse('swagger-ui'), False),
+    ]
+
+
+def get_renderers():
+    """
+    Return a list of (name, renderer) of the response renderers to measure.
+    """
+    renderers = [('json', JSONRenderer()), ('fast-json', FastJSONRenderer())]
+    if msgpack is not None:
+        renderers.append(('msgpack', MessagePackRenderer()))
+    return renderers
+
+
+def with_benchmark_caches():
+    """
+    Replace every cache with a cache of this process, so that clearing them between
+    the calls leaves alone the caches shared with the running app, e.g. memcached.
+    """
+    return override_settings(CACHES={
+        alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f'emenu-benchmark-{alias}'}
+        for alias in settings.CACHES
+    })
+
+
+def with_throttle_rates(client_rate, global_rate):
+    """
+    Override the rate limits of the public endpoints.
+    """
+    return override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {'public-client': client_rate, 'public-global': global_rate},
+    })
+
+
+def measure_throttling(url, repeat):
+    """
+    Measure the rejected requests of a scraper over its rate limit, and the requests
+    of well-behaved clients, each under its limit, while the scraper is throttled.
+    """
+    scraper = Client(HTTP_HOST='localhost', REMOTE_ADDR='10.0.0.1')
+    addresses = (f'10.1.{i // 256 % 256}.{i % 256}' for i in itertools.count())
+
+    def rejected():
+        response = scraper.get(url)
+        assert response.status_code == 429, f'{url} returned {response.status_code} to the scraper'
+        return len(response.content)
+
+    def admitted():
+        rejected()
+        response = Client(HTTP_HOST='localhost', REMOTE_ADDR=next(addresses)).get(url)
+        assert response.status_code == 200, f'{url} returned {response.status_code}'
+        return len(response.content)
+
+    caches[settings.THROTTLE_CACHE_ALIAS].clear()
+    with with_throttle_rates('1/hour', '1000000/hour'):
+        scraper.get(url)
+        return {
+            'throttle-rejected': measure(rejected, repeat, clear_cache=False),
+            'throttle-admitted': measure(admitted, repeat, clear_cache=False),
+        }
+
+
+def measure(function, repeat, warmup=1, clear_cache=True):
+    """
+    Call the function repeatedly and return its latency percentiles, the number of
+    queries of a single call, and the peak memory allocated during a single call.
+    The function returns the size of its output in bytes.
+    """
+    def call():
+        if clear_cache:
+            get_cache().clear()
+        return function()
+
+    for _ in range(warmup):
+        call()
+
+    # CaptureQueriesContext would miss the queries, since every request resets the query log.
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_query):
+        size = call()
+
+    tracemalloc.start()
+    try:
+        call()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'p50_ms': round(_percentile(latencies, 50), 3),
+        'p90_ms': round(_percentile(latencies, 90), 3),
+        'p99_ms': round(_percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'queries': len(queries),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+        'size_bytes': size,
+    }
+
+
+# The synthetic data is visible only in the uncommitted transaction on the primary database.
+@override_settings(DATABASE_REPLICAS=[])
+@with_benchmark_caches()
+def run_benchmark(seed=0, menus=100, dishes=500, menu_size=20, users=100, repeat=20,
+                  clear_cache=True):
+    """
+    Generate the synthetic data and measure every endpoint and the digest task.
+    Meant to be run inside a transaction that is rolled back afterwards.
+    """
+    menu_pks, dish_pks = generate_data(seed, menus, dishes, menu_size, users)
+    user = User.objects.create_user(username='benchmark-admin')
+    anonymous_client = Client(HTTP_HOST='localhost')
+    logged_in_client = Client(HTTP_HOST='localhost')
+    logged_in_client.force_login(user)
+
+    results = {}
+    # The endpoints are measured without the rate limits, which are measured on their own.
+    with with_throttle_rates(None, None):
+        for name, url, needs_login in get_endpoints(menu_pks[0], dish_pks[0]):
+            client = logged_in_client if needs_login else anonymous_client
+
+            def request(client=client, url=url):
+                response = client.get(url)
+                assert response.status_code == 200, f'{url} returned {response.status_code}'
+                if response.streaming:
+                    return len(b''.join(response.streaming_content))
+                return len(response.content)
+
+            results[name] = measure(request, repeat, clear_cache=clear_cache)
+    results.update(measure_throttling(
+        reverse('public-menu-detail', kwargs={'pk': menu_pks[0]}), repeat))
+
+    latest_change_id = get_latest_change_id()
+
+    def digest():
+        return sum(len(message) for _, message in get_new_dishes_mail_contents(0, latest_change_id))
+
+    results['new-dishes-mail-contents'] = measure(digest, repeat)
+
+    # The payload size and render time of the whole catalog in every format.
+    catalog = PublicMenuDetailSerializer(
+        Menu.objects.filter(pk__in=menu_pks).prefetch_related(
+            Prefetch('dishes', queryset=Dish.objects.order_by('pk'))),
+        many=True, context={'request': None}).data
+    for name, renderer in get_renderers():
+        results[f'render-{name}'] = measure(
+            lambda renderer=renderer: len(renderer.render(catalog)), repeat, clear_cache=False)
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Return a list of human readable regressions: metrics that grew more than
+    'tolerance' percent over the baseline.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            baseline_value = baseline.get(name, {}).get(metric)
+            if not baseline_value:
+                continue
+            change = (value - baseline_value) * 100 / baseline_value
+            if change > tolerance:
+                regressions.append(
+                    f'{name} {metric}: {baseline_value} -> {value} (+{change:.1f}%)')
+    return regressions
+
+
+def _percentile(sorted_values, percent):
+    index = (len(sorted_values) - 1) * percent / 100
+    lower = int(index)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (index - lower)
@@ -0,0 +1,91 @@
+from django.db import transaction
+from django.utils import timezone
+from emenu.menu.models import Change, Dish, Menu
+from emenu.menu.serializers import DishImportSerializer
+from emenu.menu.signals import menus_changed
+from itertools import islice
+
+BATCH_SIZE = 500
+
+
+def upsert_dishes(rows, batch_size=BATCH_SIZE):
+    """
+    Create or update dishes, matched by name, from an iterable of dicts.
+    The rows are processed in batches inside a single transaction.
+    Invalid rows are skipped and reported.
+    Dishes whose fields all equal the row are left alone, so that a repeated import
+    neither touches them nor logs changes.
+    Returns a dict with the numbers of created, updated and unchanged dishes and the list
+    of row errors.
+    """
+    result = {'created': 0, 'updated': 0, 'unchanged': 0, 'errors': []}
+    seen_names = set()
+    changes = []
+    rows = enumerate(rows)
+    with transaction.atomic():
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            valid_rows = []
+            for index, row in batch:
+                serializer = DishImportSerializer(data=row)
+                if not serializer.is_valid():
+                    result['errors'].append(
+                        {'row': index, 'errors': serializer.errors})
+                elif serializer.validated_data['name'] in seen_names:
+                    result['errors'].append(
+                        {'row': index, 'errors': {'name': ['Duplicate dish name in the import.']}})
+                else:
+                    seen_names.add(serializer.validated_data['name'])
+                    valid_rows.append(serializer.validated_data)
+            created, updated = _upsert_batch(valid_rows, changes)
+            result['created'] += created
+            result['updated'] += updated
+            result['unchanged'] += len(valid_rows) - created - updated
+        # Logged right before the commit, since the readers of the log assume that
+        # its entries are committed soon after they are inserted.
+        Change.objects.bulk_create(changes)
+    return result
+
+
+def _upsert_batch(valid_rows, changes):
+    existing_dishes = Dish.objects.in_bulk(
+        [row['name'] for row in valid_rows], field_name='name')
+    now = timezone.now()
+    new_dishes = []
+    changed_dishes = []
+    for row in valid_rows:
+        dish = existing_dishes.get(row['name'])
+        if dish is None:
+            new_dishes.append(Dish(**row))
+            continue
+        if all(getattr(dish, field) == value for field, value in row.items()):
+            continue
+        for field, value in row.items():
+            setattr(dish, field, value)
+        # bulk_update() does not fill in auto_now fields.
+        dish.date_modified = now
+        changed_dishes.append(dish)
+
+    # Bulk operations bypass the signal handlers, so the changes are collected here.
+    if new_dishes:
+        Dish.objects.bulk_create(new_dishes)
+        # Not every database returns the primary keys from bulk_create().
+        changes += [
+            Change(model=Change.DISH, object_id=pk, action=Change.CREATED)
+            for pk in Dish.objects.filter(
+                name__in=[dish.name for dish in new_dishes]).values_list('pk', flat=True)
+        ]
+    menu_pks = set()
+    if changed_dishes:
+        Dish.objects.bulk_update(
+            changed_dishes, DishImportSerializer.Meta.fields + ['date_modified'])
+        menu_pks = set(Menu.dishes.through.objects.filter(
+            dish__in=changed_dishes).values_list('menu_id', flat=True))
+        changes += [Change(model=Change.DISH, object_id=dish.pk, action=Change.UPDATED)
+                    for dish in changed_dishes]
+        changes += [Change(model=Change.MENU, object_id=pk, action=Change.UPDATED)
+                    for pk in menu_pks]
+    menus_changed(menu_pks)
+    return len(new_dishes), len(changed_dishes)
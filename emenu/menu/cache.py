@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from emenu.db.routers import read_primary
+from hashlib import md5
+from rest_framework.response import Response
+from uuid import uuid4
+
+LIST_VERSION_KEY = 'public-menu:list:version'
+DETAIL_VERSION_KEY = 'public-menu:detail:{pk}:version'
+
+
+def get_cache():
+    return caches[settings.PUBLIC_MENU_CACHE_ALIAS]
+
+
+def _get_version(version_key):
+    cache = get_cache()
+    version = cache.get(version_key)
+    if version is None:
+        # A fresh random version never collides with entries stored under
+        # a version that has since been evicted.
+        cache.add(version_key, uuid4().hex, None)
+        version = cache.get(version_key)
+    return version
+
+
+def _bump_versions(version_keys):
+    version_keys = list(version_keys)
+    if not version_keys:
+        return
+
+    def bump():
+        get_cache().set_many({key: uuid4().hex for key in version_keys}, None)
+
+    # Bump now, so that this process stops serving stale data, and once more
+    # after commit, in case a concurrent request cached the old data in between.
+    bump()
+    transaction.on_commit(bump)
+
+
+def invalidate_menus(menu_pks):
+    """
+    Evict the cached details of the given menus and the cached menu list.
+    """
+    _bump_versions([LIST_VERSION_KEY] +
+                   [DETAIL_VERSION_KEY.format(pk=pk) for pk in set(menu_pks)])
+
+
+def get_list_cache_key(request):
+    return _get_cache_key(LIST_VERSION_KEY, request)
+
+
+def get_detail_cache_key(request, pk):
+    return _get_cache_key(DETAIL_VERSION_KEY.format(pk=pk), request)
+
+
+def _get_cache_key(version_key, request):
+    uri_hash = md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return f'{version_key}:{_get_version(version_key)}:{uri_hash}'
+
+
+class CachedResponseMixin:
+    """
+    Serve responses from the cache of serialized data.
+
+    The cache keys embed a version, which the signal handlers bump whenever
+    a menu, a dish or their relation changes. The cache misses are read from
+    the primary database, while the views read the replicas otherwise.
+    """
+
+    def get_cached_response(self, cache_key, handler, request, *args, **kwargs):
+        cache = get_cache()
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+        # A lagging replica could still hold the data from before the change which bumped
+        # the version, and it would stay cached under the new version until the timeout.
+        with read_primary():
+            response = handler(request, *args, **kwargs)
+        # Responses served from snapshots have no data and need no caching.
+        if response.status_code == 200 and hasattr(response, 'data'):
+            cache.set(cache_key, response.data,
+                      settings.PUBLIC_MENU_CACHE_TIMEOUT)
+        return response
+
+
+class CachedListMixin(CachedResponseMixin):
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(get_list_cache_key(request),
+                                        super().list, request, *args, **kwargs)
+
+
+class CachedRetrieveMixin(CachedResponseMixin):
+    def retrieve(self, request, *args, **kwargs):
+        cache_key = get_detail_cache_key(request, kwargs[self.lookup_field])
+        return self.get_cached_response(cache_key,
+                                        super().retrieve, request, *args, **kwargs)
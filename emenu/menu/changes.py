@@ -0,0 +1,78 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from emenu.menu.models import Change, ChangeWatermark
+
+
+def log_changes(model, action, object_ids):
+    """
+    Append a change of each of the objects to the change log.
+    """
+    Change.objects.bulk_create([
+        Change(model=model, object_id=object_id, action=action)
+        for object_id in object_ids
+    ])
+
+
+def get_latest_change_id():
+    return Change.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def _get_settled_date():
+    """
+    Return the date before which every entry of the log has been committed.
+
+    The ids are taken in the order of the inserts, not of the commits, so an entry of
+    a transaction still in progress may show up later below the ids read already.
+    The transactions are assumed to commit within CHANGE_LOG_SAFETY_LAG seconds.
+    """
+    return timezone.now() - timedelta(seconds=settings.CHANGE_LOG_SAFETY_LAG)
+
+
+def get_settled_change_id():
+    """
+    Return the highest id up to which no entry of the log can show up any more.
+    """
+    return Change.objects.filter(date__lte=_get_settled_date()).aggregate(
+        latest=Max('id'))['latest'] or 0
+
+
+def get_changes(model, since, limit):
+    """
+    Return a tuple (changes, cursor, has_more) of the changes of the model after
+    the 'since' cursor, reading at most 'limit' entries of the log.
+    Only the last change of every object is kept, in the order of the log.
+
+    The cursor does not pass the entries younger than CHANGE_LOG_SAFETY_LAG, so these
+    are listed again by the next request, along with any entry committed in between.
+    """
+    settled_date = _get_settled_date()
+    entries = list(Change.objects.filter(model=model, id__gt=since).order_by('id').only(
+        'id', 'object_id', 'action', 'date')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    last_changes = {}
+    for change in entries:
+        last_changes.pop(change.object_id, None)
+        last_changes[change.object_id] = change
+    cursor = since
+    for change in entries:
+        if change.date > settled_date:
+            # The rest is listed again from the returned cursor, in the next request.
+            has_more = False
+            break
+        cursor = change.id
+    return list(last_changes.values()), cursor, has_more
+
+
+def get_watermark(name):
+    """
+    Return the id of the last change consumed by the named reader, 0 at first.
+    """
+    return ChangeWatermark.objects.filter(name=name).values_list(
+        'change_id', flat=True).first() or 0
+
+
+def set_watermark(name, change_id):
+    ChangeWatermark.objects.update_or_create(name=name, defaults={'change_id': change_id})
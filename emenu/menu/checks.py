@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_public_menu_cache(app_configs, **kwargs):
+    """
+    The versions of the cached public responses are bumped by the process which changes
+    the menus, so a cache of every process for itself keeps the stale responses of the
+    other processes (gunicorn workers, Celery, management commands) until they expire.
+    """
+    backend = settings.CACHES[settings.PUBLIC_MENU_CACHE_ALIAS]['BACKEND']
+    if settings.DEBUG or backend != 'django.core.cache.backends.locmem.LocMemCache':
+        return []
+    return [Warning(
+        f"The public menu cache '{settings.PUBLIC_MENU_CACHE_ALIAS}' uses {backend}, "
+        "which is not shared by the processes, so they serve stale menus after changes.",
+        hint='Set CACHE_BACKEND and CACHE_LOCATION to a shared cache, e.g. memcached.',
+        id='menu.W001',
+    )]
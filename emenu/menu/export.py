@@ -0,0 +1,73 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, prefetch_related_objects
+from emenu.menu.models import Dish, Menu
+from emenu.menu.serializers import DishSerializer, PublicMenuDetailSerializer
+from itertools import islice
+import csv
+import json
+
+CHUNK_SIZE = 500
+
+MENU_CSV_FIELDS = ['pk', 'name', 'description', 'date_added', 'date_modified']
+DISH_CSV_FIELDS = DishSerializer.Meta.fields
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_menu_chunks(chunk_size=CHUNK_SIZE):
+    """
+    Yield lists of menus with their dishes prefetched, reading the menus
+    through a server-side cursor so that only one chunk is held in memory.
+    """
+    menus = Menu.objects.order_by('pk').iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(menus, chunk_size))
+        if not chunk:
+            return
+        # QuerySet.iterator() ignores prefetch_related(), so prefetch by hand.
+        prefetch_related_objects(
+            chunk, Prefetch('dishes', queryset=Dish.objects.order_by('pk')))
+        yield chunk
+
+
+def iter_catalog_ndjson(serializer_context):
+    """
+    Yield one JSON line per menu, with the dishes nested as in the public menu details.
+    """
+    for chunk in iter_menu_chunks():
+        for menu in PublicMenuDetailSerializer(chunk, many=True, context=serializer_context).data:
+            yield json.dumps(menu, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_catalog_csv(serializer_context):
+    """
+    Yield one CSV line per menu and dish pair. Menus without dishes get a single line.
+    """
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(['menu_' + field for field in MENU_CSV_FIELDS] +
+                          ['dish_' + field for field in DISH_CSV_FIELDS])
+    for chunk in iter_menu_chunks():
+        for menu in PublicMenuDetailSerializer(chunk, many=True, context=serializer_context).data:
+            menu_row = [menu[field] for field in MENU_CSV_FIELDS]
+            if not menu['dishes']:
+                yield writer.writerow(menu_row + [''] * len(DISH_CSV_FIELDS))
+            for dish in menu['dishes']:
+                yield writer.writerow(menu_row + [dish[field] for field in DISH_CSV_FIELDS])
+
+
+def iter_catalog(export_format, serializer_context):
+    if export_format == 'csv':
+        return iter_catalog_csv(serializer_context)
+    return iter_catalog_ndjson(serializer_context)
+
+
+class _EchoBuffer:
+    """
+    A file-like object for csv.writer, which returns the lines instead of storing them.
+    """
+
+    def write(self, value):
+        return value
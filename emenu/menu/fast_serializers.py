@@ -0,0 +1,83 @@
+from collections import OrderedDict, defaultdict
+from emenu.menu.models import Dish
+from emenu.menu.serializers import DishSerializer, PublicMenuDetailSerializer
+from emenu.menu.relations import get_url_formatter
+from functools import lru_cache
+
+MENU_FIELDS = ['name', 'description', 'date_added', 'date_modified']
+DISH_FIELDS = ['name', 'description', 'price', 'preparation_time',
+               'date_added', 'date_modified', 'is_vegan']
+
+
+@lru_cache(maxsize=None)
+def _get_field_mappers(serializer_class, field_names):
+    """
+    Return a tuple of (field_name, to_representation) of the given serializer fields.
+    The DRF fields are built once, and then only their to_representation is called.
+    """
+    fields = serializer_class().fields
+    return tuple((name, fields[name].to_representation) for name in field_names)
+
+
+class FastPublicMenuSerializer:
+    """
+    Read-only serializer, which builds the same data as PublicMenuSimpleSerializer
+    (or PublicMenuDetailSerializer, with 'detail') from values() rows of menus,
+    without building a serializer and its fields for every object.
+    Only the dishes matching the 'dish_conditions' lookups are listed.
+    """
+
+    def __init__(self, request, detail=False, format=None, dish_conditions=None):
+        self.request = request
+        self.detail = detail
+        self.format = format
+        self.dish_conditions = dish_conditions or {}
+        # Snapshots are built without a request, so the formatters are kept here too.
+        self._url_formatters = {}
+
+    def get_menu_values(self, queryset):
+        """
+        Return a values() queryset of the menu rows this serializer needs.
+        The ordering fields of the public menu list are included for the pagination.
+        """
+        return queryset.prefetch_related(None).values('pk', 'dish_count', *MENU_FIELDS)
+
+    def to_representation(self, menu_rows):
+        menu_mappers = _get_field_mappers(PublicMenuDetailSerializer, tuple(MENU_FIELDS))
+        dishes_by_menu = self._get_dishes_by_menu([row['pk'] for row in menu_rows])
+        data = []
+        for row in menu_rows:
+            menu = OrderedDict()
+            menu['url'] = self._get_url('public-menu-detail', row['pk'])
+            for name, to_representation in menu_mappers:
+                menu[name] = to_representation(row[name])
+            menu['dishes'] = dishes_by_menu.get(row['pk'], [])
+            menu['pk'] = row['pk']
+            data.append(menu)
+        return data
+
+    def _get_dishes_by_menu(self, menu_pks):
+        dishes_by_menu = defaultdict(list)
+        # Same order of dishes as the prefetch of the public viewsets.
+        dishes = Dish.objects.filter(
+            menu__in=menu_pks, **self.dish_conditions).order_by('pk')
+        if not self.detail:
+            for menu_pk, name in dishes.values_list('menu', 'name'):
+                dishes_by_menu[menu_pk].append(name)
+            return dishes_by_menu
+
+        dish_mappers = _get_field_mappers(DishSerializer, tuple(DISH_FIELDS))
+        for row in dishes.values('menu', 'pk', *DISH_FIELDS):
+            dish = OrderedDict()
+            dish['url'] = self._get_url('dish-detail', row['pk'])
+            for name, to_representation in dish_mappers:
+                dish[name] = to_representation(row[name])
+            dishes_by_menu[row['menu']].append(dish)
+        return dishes_by_menu
+
+    def _get_url(self, view_name, pk):
+        formatter = self._url_formatters.get(view_name)
+        if formatter is None:
+            formatter = self._url_formatters[view_name] = get_url_formatter(
+                view_name, self.request, self.format)
+        return formatter(pk)
@@ -1,8 +1,51 @@
+from django.db.models import Exists, OuterRef
 import django_filters
-from emenu.menu.models import Menu
+from emenu.menu.models import Dish, Menu
+from rest_framework import filters
 
 
-class MenuFilter(django_filters.FilterSet):
+class MenuDishFilter(django_filters.FilterSet):
+    """
+    Filter menus by the attributes of their dishes, e.g. menus with a vegan dish under 30 PLN.
+
+    All dish filters have to hold for the same dish, so they are combined into a single
+    EXISTS subquery over Menu.dishes instead of being applied one by one.
+    """
+    is_vegan = django_filters.BooleanFilter(label='Dish is vegan')
+    price__gte = django_filters.NumberFilter(label='Dish price is greater than or equal to')
+    price__lte = django_filters.NumberFilter(label='Dish price is less than or equal to')
+    preparation_time__gte = django_filters.DurationFilter(
+        label='Dish preparation time is greater than or equal to')
+    preparation_time__lte = django_filters.DurationFilter(
+        label='Dish preparation time is less than or equal to')
+
+    # The names of the filters above are the lookups of Dish they stand for.
+    dish_filters = ('is_vegan', 'price__gte', 'price__lte',
+                    'preparation_time__gte', 'preparation_time__lte')
+
+    class Meta:
+        model = Menu
+        fields = []
+
+    def get_dish_conditions(self):
+        """
+        Return the Dish lookups of the given dish filters. You must call `is_valid()` first.
+        """
+        return {name: value for name, value in self.form.cleaned_data.items()
+                if name in self.dish_filters and value is not None}
+
+    def filter_queryset(self, queryset):
+        for name, value in self.form.cleaned_data.items():
+            if name not in self.dish_filters:
+                queryset = self.filters[name].filter(queryset, value)
+        dish_conditions = self.get_dish_conditions()
+        if dish_conditions:
+            queryset = queryset.filter(Exists(Dish.objects.filter(
+                menu=OuterRef('pk'), **dish_conditions)))
+        return queryset
+
+
+class MenuFilter(MenuDishFilter):
     class Meta:
         model = Menu
         fields = {
@@ -10,3 +53,22 @@ class MenuFilter(django_filters.FilterSet):
             'date_added': ['exact', 'lt', 'lte', 'gt', 'gte'],
             'date_modified': ['exact', 'lt', 'lte', 'gt', 'gte'],
         }
+
+
+class AliasedOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter that accepts old field names and orders by their replacements.
+    The view lists the aliases in 'ordering_aliases', e.g. {'dishes__count': 'dish_count'}.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        aliases = getattr(view, 'ordering_aliases', {})
+        return [self._resolve_alias(term, aliases) for term in ordering]
+
+    def _resolve_alias(self, term, aliases):
+        prefix = '-' if term.startswith('-') else ''
+        field = term.lstrip('-')
+        return prefix + aliases.get(field, field)
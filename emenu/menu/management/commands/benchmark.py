@@ -0,0 +1,58 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from emenu.menu.benchmark import compare_with_baseline, run_benchmark
+import json
+
+
+class Command(BaseCommand):
+    """Django command to measure the API endpoints and the digest task on synthetic data"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--menus', type=int, default=100)
+        parser.add_argument('--dishes', type=int, default=500)
+        parser.add_argument('--menu-size', type=int, default=20,
+                            help='Number of dishes in each menu')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of measured calls of each endpoint')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the public menu cache between calls')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Compare the results with this JSON file')
+        parser.add_argument('--tolerance', type=float, default=20,
+                            help='Allowed growth of a metric over the baseline, in percent')
+
+    def handle(self, *args, **options):
+        config = {key: options[key] for key in
+                  ('seed', 'menus', 'dishes', 'menu_size', 'users', 'repeat', 'warm_cache')}
+        if options['menu_size'] > options['dishes']:
+            raise CommandError('--menu-size cannot be larger than --dishes.')
+
+        # The synthetic data never outlives the benchmark.
+        with transaction.atomic():
+            results = run_benchmark(
+                seed=options['seed'], menus=options['menus'], dishes=options['dishes'],
+                menu_size=options['menu_size'], users=options['users'],
+                repeat=options['repeat'], clear_cache=not options['warm_cache'])
+            transaction.set_rollback(True)
+
+        report = json.dumps({'config': config, 'results': results},
+                            indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+            if baseline.get('config') != config:
+                self.stderr.write(
+                    'The baseline was measured with a different configuration.')
+            regressions = compare_with_baseline(
+                results, baseline['results'], options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions over the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions over the baseline.'))
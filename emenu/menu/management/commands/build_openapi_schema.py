@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+from emenu.menu.schema import write_schema
+
+
+class Command(BaseCommand):
+    """Django command to generate the OpenAPI schema served by the 'openapi/' view"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.OPENAPI_SCHEMA_FILE,
+                            help='Write the schema to this JSON file')
+
+    def handle(self, *args, **options):
+        write_schema(options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote the OpenAPI schema to {options['output']}."))
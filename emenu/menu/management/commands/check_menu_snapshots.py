@@ -0,0 +1,39 @@
+from django.core.management import BaseCommand, CommandError
+from emenu.menu.export import iter_menu_chunks
+from emenu.menu.models import MenuSnapshot
+from emenu.menu.serializers import PublicMenuDetailSerializer, PublicMenuSimpleSerializer
+from emenu.menu.snapshots import build_snapshots, render_json
+import itertools
+
+
+class Command(BaseCommand):
+    """Django command to compare the stored menu snapshots with live serialization"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild the missing and inconsistent snapshots')
+
+    def handle(self, *args, **options):
+        snapshots = MenuSnapshot.objects.in_bulk()
+        context = {'request': None}
+        stale_menu_pks = []
+        for menu in itertools.chain.from_iterable(iter_menu_chunks()):
+            snapshot = snapshots.get(menu.pk)
+            if snapshot is None:
+                self.stdout.write(f'Menu {menu.pk} has no snapshot.')
+                stale_menu_pks.append(menu.pk)
+                continue
+            detail = render_json(PublicMenuDetailSerializer(menu, context=context).data)
+            list_item = render_json(PublicMenuSimpleSerializer(menu, context=context).data)
+            if bytes(snapshot.detail) != detail or bytes(snapshot.list_item) != list_item:
+                self.stdout.write(f'Menu {menu.pk} has an inconsistent snapshot.')
+                stale_menu_pks.append(menu.pk)
+
+        if not stale_menu_pks:
+            self.stdout.write(self.style.SUCCESS('All menu snapshots are consistent.'))
+        elif options['rebuild']:
+            build_snapshots(stale_menu_pks)
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt {len(stale_menu_pks)} menu snapshots.'))
+        else:
+            raise CommandError(f'{len(stale_menu_pks)} menu snapshots are missing or inconsistent.')
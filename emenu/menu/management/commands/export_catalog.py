@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+from emenu.menu.export import EXPORT_FORMATS, iter_catalog
+
+
+class Command(BaseCommand):
+    """Django command to stream all menus with their dishes to a file"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--export-format', choices=list(EXPORT_FORMATS),
+                            default='ndjson')
+        parser.add_argument('--output', help='Output file, standard output by default')
+
+    def handle(self, *args, **options):
+        # Without a request, the hyperlinks are relative.
+        lines = iter_catalog(options['export_format'], {'request': None})
+        if options['output'] is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+            file.writelines(lines)
@@ -0,0 +1,34 @@
+from django.core.management import BaseCommand, CommandError
+from emenu.menu.bulk import upsert_dishes
+from emenu.menu.parsers import parse_ndjson_lines
+from rest_framework.exceptions import ParseError
+import json
+
+
+class Command(BaseCommand):
+    """Django command to create or update dishes from a JSON array or NDJSON file"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSON array or NDJSON file with dishes')
+
+    def handle(self, *args, **options):
+        with open(options['path'], encoding='utf-8') as file:
+            try:
+                result = upsert_dishes(self._read_rows(file))
+            except (ParseError, ValueError) as exc:
+                raise CommandError(f'Could not parse {options["path"]}: {exc}')
+
+        for error in result['errors']:
+            self.stderr.write(f'Row {error["row"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result["created"]}, updated {result["updated"]} and left '
+            f'{result["unchanged"]} unchanged dishes, skipped {len(result["errors"])} invalid rows.'))
+
+    def _read_rows(self, file):
+        first_char = file.read(1)
+        while first_char.isspace():
+            first_char = file.read(1)
+        file.seek(0)
+        if first_char == '[':
+            return json.load(file)
+        return parse_ndjson_lines(file)
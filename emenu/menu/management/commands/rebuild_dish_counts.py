@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from emenu.menu.models import Menu
+from emenu.menu.signals import dishes_of_menus_changed
+
+
+class Command(BaseCommand):
+    """Django command to recompute the dish count of every menu"""
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            menu_pks = list(Menu.objects.with_wrong_dish_counts().values_list('pk', flat=True))
+            Menu.objects.filter(pk__in=menu_pks).update_dish_counts()
+            # The counts are public, so the menus are logged and their cached data dropped.
+            dishes_of_menus_changed(menu_pks)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt dish counts of {len(menu_pks)} menus.'))
@@ -0,0 +1,96 @@
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+import json
+import logging
+import time
+
+logger = logging.getLogger('emenu.performance')
+
+
+class _RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view_start = None
+        self.view_end = None
+        self.render_end = None
+        self.queries = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+
+class PerformanceTimingMiddleware:
+    """
+    Measure the number and time of queries, the view time and the render time of each request.
+    The timings are sent in the Server-Timing header. Requests slower than
+    SLOW_REQUEST_THRESHOLD_MS are logged to the 'emenu.performance' logger with their slowest queries.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = _RequestTimings()
+        request._performance_timings = timings
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(timings.execute_wrapper))
+            response = self.get_response(request)
+        end = time.perf_counter()
+
+        metrics = self._get_metrics(timings, end)
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration:.1f}' + (f';desc="{description}"' if description else '')
+            for name, duration, description in metrics)
+        if (end - timings.start) * 1000 >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            self._log_slow_request(request, response, timings, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._performance_timings.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        timings = request._performance_timings
+        timings.view_end = time.perf_counter()
+
+        def render_finished(response):
+            timings.render_end = time.perf_counter()
+
+        response.add_post_render_callback(render_finished)
+        return response
+
+    def _get_metrics(self, timings, end):
+        """
+        Return a list of (name, duration_ms, description) tuples.
+        """
+        db_time = sum(duration for _, duration in timings.queries)
+        metrics = [('db', db_time * 1000, f'{len(timings.queries)} queries')]
+        if timings.view_start is not None:
+            view_end = timings.view_end or end
+            metrics.append(('view', (view_end - timings.view_start) * 1000, ''))
+            if timings.render_end is not None:
+                metrics.append(('render', (timings.render_end - view_end) * 1000, ''))
+        metrics.append(('total', (end - timings.start) * 1000, ''))
+        return metrics
+
+    def _log_slow_request(self, request, response, timings, metrics):
+        slowest_queries = sorted(timings.queries, key=lambda query: query[1], reverse=True)
+        record = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'timings_ms': {name: round(duration, 1) for name, duration, _ in metrics},
+            'query_count': len(timings.queries),
+            'slowest_queries': [
+                {'sql': sql, 'duration_ms': round(duration * 1000, 1)}
+                for sql, duration in slowest_queries[:settings.SLOW_REQUEST_LOGGED_QUERIES]
+            ],
+        }
+        logger.warning('Slow request: %s', json.dumps(record),
+                       extra={'slow_request': record})
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_dish_counts(apps, schema_editor):
+    Menu = apps.get_model('menu', 'Menu')
+    dish_counts = Menu.dishes.through.objects.filter(menu_id=OuterRef('pk')).order_by().values(
+        'menu_id').annotate(count=Count('dish_id')).values('count')
+    Menu.objects.update(dish_count=Coalesce(Subquery(dish_counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='dish',
+            options={'verbose_name_plural': 'dishes'},
+        ),
+        migrations.AddField(
+            model_name='menu',
+            name='dish_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(populate_dish_counts, migrations.RunPython.noop),
+    ]
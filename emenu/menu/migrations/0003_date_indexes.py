@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0002_menu_dish_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['date_added'], name='menu_dish_date_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['date_modified', 'date_added'], name='menu_dish_modified_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menu',
+            index=models.Index(fields=['date_added'], name='menu_menu_date_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menu',
+            index=models.Index(fields=['date_modified'], name='menu_menu_date_modified_idx'),
+        ),
+    ]
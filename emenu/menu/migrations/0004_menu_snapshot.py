@@ -0,0 +1,23 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0003_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuSnapshot',
+            fields=[
+                ('menu', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='menu.menu')),
+                ('detail', models.BinaryField()),
+                ('list_item', models.BinaryField()),
+                ('date_built', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+INDEXES = [
+    ('dish', 'menu_dish_search_idx'),
+    ('menu', 'menu_menu_search_idx'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    # GIN indexes over a tsvector exist only in PostgreSQL. Other databases
+    # fall back to a scan in emenu.menu.search.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.indexes import GinIndex
+    from emenu.menu.search import get_search_vector
+
+    for model_name, index_name in INDEXES:
+        model = apps.get_model('menu', model_name)
+        schema_editor.add_index(model, GinIndex(get_search_vector(), name=index_name))
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, index_name in INDEXES:
+        schema_editor.execute(
+            f'DROP INDEX IF EXISTS {schema_editor.quote_name(index_name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0004_menu_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
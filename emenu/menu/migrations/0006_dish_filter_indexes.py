@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0005_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['price', 'preparation_time'], name='menu_dish_price_prep_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(condition=models.Q(('is_vegan', True)), fields=['price', 'preparation_time'], name='menu_dish_vegan_price_prep_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-18 21:19
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0007_change_log'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='dish',
+            name='menu_dish_date_added_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='dish',
+            name='menu_dish_modified_added_idx',
+        ),
+    ]
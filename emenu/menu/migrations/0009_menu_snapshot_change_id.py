@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 21:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0008_remove_dish_date_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menusnapshot',
+            name='change_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
-from django.db.models import fields
+from django.db.models import Count, F, OuterRef, Q, Subquery, fields
+from django.db.models.functions import Coalesce
 
 
 class Dish(models.Model):
@@ -16,6 +17,36 @@ class Dish(models.Model):
 
     class Meta:
         verbose_name_plural = "dishes"
+        indexes = [
+            # Serve the dish filters of the public menus (see MenuDishFilter).
+            # Most of the filtered lookups ask for vegan dishes, which get a smaller index.
+            models.Index(fields=['price', 'preparation_time'],
+                         name='menu_dish_price_prep_idx'),
+            models.Index(fields=['price', 'preparation_time'],
+                         condition=Q(is_vegan=True),
+                         name='menu_dish_vegan_price_prep_idx'),
+        ]
+
+
+def _count_dishes():
+    dish_counts = Menu.dishes.through.objects.filter(menu_id=OuterRef('pk')).order_by().values(
+        'menu_id').annotate(count=Count('dish_id')).values('count')
+    return Coalesce(Subquery(dish_counts), 0)
+
+
+class MenuQuerySet(models.QuerySet):
+    def update_dish_counts(self):
+        """
+        Recompute the denormalized dish_count of the menus in a single UPDATE.
+        """
+        return self.update(dish_count=_count_dishes())
+
+    def with_wrong_dish_counts(self):
+        """
+        Filter the menus whose dish_count differs from the number of their dishes.
+        """
+        return self.alias(actual_dish_count=_count_dishes()).exclude(
+            dish_count=F('actual_dish_count'))
 
 
 class Menu(models.Model):
@@ -24,6 +55,75 @@ class Menu(models.Model):
     date_added = fields.DateTimeField(auto_now_add=True)
     date_modified = fields.DateTimeField(auto_now=True)
     dishes = models.ManyToManyField(to=Dish)
+    # Kept equal to the number of dishes by the signal handlers.
+    dish_count = fields.PositiveIntegerField(
+        default=0, db_index=True, editable=False)
+
+    objects = MenuQuerySet.as_manager()
 
     def __str__(self):
         return self.name
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # The count is written only by update_dish_counts(), so that a menu loaded before
+        # a concurrent change of its dishes does not write back a stale count.
+        if not self._state.adding and not force_insert and update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name != 'dish_count']
+        super().save(force_insert=force_insert, force_update=force_update, using=using,
+                     update_fields=update_fields)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_added'],
+                         name='menu_menu_date_added_idx'),
+            models.Index(fields=['date_modified'],
+                         name='menu_menu_date_modified_idx'),
+        ]
+
+
+class MenuSnapshot(models.Model):
+    """
+    The public JSON documents of a menu, rendered ahead of time with relative URLs.
+    A missing snapshot means that the menu changed and the snapshot is being rebuilt.
+    """
+    menu = models.OneToOneField(
+        Menu, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    detail = fields.BinaryField()
+    list_item = fields.BinaryField()
+    date_built = fields.DateTimeField(auto_now=True)
+    # The id of the last change of the menu read before rendering the snapshot.
+    change_id = fields.BigIntegerField(default=0)
+
+
+class Change(models.Model):
+    """
+    An entry of the append-only log of created, updated and deleted dishes and menus.
+    The ids of the entries are the cursors of the change feed.
+    """
+    DISH = 'dish'
+    MENU = 'menu'
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+
+    model = fields.CharField(max_length=4, choices=[(DISH, 'Dish'), (MENU, 'Menu')])
+    object_id = fields.BigIntegerField()
+    action = fields.CharField(max_length=7, choices=[
+        (CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted')])
+    date = fields.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Every reader of the log follows the changes of one model.
+            models.Index(fields=['model', 'id'],
+                         name='menu_change_model_id_idx'),
+        ]
+
+
+class ChangeWatermark(models.Model):
+    """
+    The id of the last change consumed by a reader of the change log, e.g. the daily digest.
+    """
+    name = fields.CharField(max_length=100, primary_key=True)
+    change_id = fields.BigIntegerField(default=0)
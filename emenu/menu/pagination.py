@@ -0,0 +1,226 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+import json
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks by the full ordering key instead of OFFSET.
+
+    The cursor stores the values of every ordering field of the boundary row,
+    with 'pk' appended as a tie breaker, so the ordering is always total and
+    the page query is a plain range condition, no matter how deep the page is.
+    The ordering is taken from the view's OrderingFilter when there is one,
+    and stored in the cursor too, which is only valid for the same ordering.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('pk',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.reverse, self.position = self.decode_cursor(request, queryset)
+
+        if self.reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if self.position is not None:
+            queryset = queryset.filter(
+                self._get_seek_condition(self.position, self.reverse))
+
+        # Fetch one extra row to find out if there is anything past this page.
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_previous = has_more
+            self.has_next = self.position is not None
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Return the ordering of the view, extended with 'pk' so that it is total.
+        The ordering comes from the OrderingFilter, or else from the 'ordering' of the view.
+        """
+        ordering = None
+        for filter_cls in getattr(view, 'filter_backends', []):
+            if hasattr(filter_cls, 'get_ordering'):
+                ordering = filter_cls().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = getattr(view, 'ordering', None) or self.ordering
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+
+        ordering = tuple(ordering)
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering += ('pk',)
+        return ordering
+
+    def _get_seek_condition(self, position, reverse):
+        """
+        Build the row comparison (a, b, c) > (x, y, z) as an OR of prefixes,
+        honouring the direction of every ordering field.
+        """
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            descending = field.startswith('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = Q(**{field.lstrip('-') + '__' + lookup: position[index]})
+            for previous_field, previous_value in zip(self.ordering[:index], position[:index]):
+                clause &= Q(**{previous_field.lstrip('-'): previous_value})
+            condition |= clause
+        return condition
+
+    def _get_position_from_instance(self, instance):
+        position = []
+        for field in self.ordering:
+            field_name = field.lstrip('-')
+            if isinstance(instance, dict):
+                position.append(instance[field_name])
+            else:
+                position.append(getattr(instance, field_name))
+        return position
+
+    def decode_cursor(self, request, queryset):
+        """
+        Return a (reverse, position) tuple of the cursor from the request.
+        The values of the position are converted to the types of the ordering fields.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+
+        try:
+            tokens = json.loads(b64decode(encoded.encode('ascii')))
+            reverse = bool(tokens['r'])
+            ordering = tokens['o']
+            position = tokens['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != list(self.ordering) or not isinstance(position, list) \
+                or len(position) != len(self.ordering):
+            # The cursor was made for a different ordering.
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [self._to_python(queryset, field.lstrip('-'), value)
+                        for field, value in zip(self.ordering, position)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    def _to_python(self, queryset, field_name, value):
+        if value is None or isinstance(value, (list, dict)):
+            raise ValueError(f'Invalid value of {field_name}: {value!r}')
+        if field_name in queryset.query.annotations:
+            field = queryset.query.annotations[field_name].output_field
+        elif field_name == 'pk':
+            field = queryset.model._meta.pk
+        else:
+            field = queryset.model._meta.get_field(field_name)
+        return field.to_python(value)
+
+    def encode_cursor(self, reverse, position):
+        tokens = json.dumps({'r': int(reverse), 'o': self.ordering, 'p': position},
+                            cls=DjangoJSONEncoder, separators=(',', ':'))
+        encoded = b64encode(tokens.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1])
+        else:
+            position = self.position
+        return self.encode_cursor(False, position)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[0])
+        else:
+            position = self.position
+        return self.encode_cursor(True, position)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {
+                    'type': 'string',
+                },
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {
+                    'type': 'integer',
+                },
+            },
+        ]
+
+
+def _reverse_ordering(ordering):
+    return tuple(field[1:] if field.startswith('-') else '-' + field
+                 for field in ordering)
@@ -0,0 +1,28 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+import json
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses a newline delimited JSON stream lazily, one object per line.
+    Returns a generator, so the rows are never all held in memory.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        return parse_ndjson_lines(stream, encoding)
+
+
+def parse_ndjson_lines(lines, encoding='utf-8'):
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode(encoding)
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            raise ParseError(f'NDJSON parse error on line {line_number} - {exc}')
@@ -0,0 +1,125 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField
+from rest_framework.reverse import reverse
+
+# Reversed in place of the lookup value, and then replaced by the actual one.
+# It is made of digits, so that it matches any URL pattern of a primary key.
+LOOKUP_VALUE_MARKER = '9081726354'
+
+
+def get_url_formatter(view_name, request=None, format=None, lookup_url_kwarg='pk'):
+    """
+    Return a function which builds the same URL of the view for a lookup value as reverse().
+
+    The URL is reversed once, with a marker instead of the lookup value, and then only
+    integer lookup values are formatted into it. The formatters are kept on the request.
+    """
+    cache_key = (view_name, format, lookup_url_kwarg)
+    formatters = getattr(request, '_url_formatters', None)
+    if formatters is not None and cache_key in formatters:
+        return formatters[cache_key]
+
+    url = reverse(view_name, kwargs={lookup_url_kwarg: LOOKUP_VALUE_MARKER},
+                  request=request, format=format)
+    prefix, marker, suffix = url.rpartition(LOOKUP_VALUE_MARKER)
+    can_format = url.count(LOOKUP_VALUE_MARKER) == 1
+
+    def format_url(lookup_value):
+        if can_format and type(lookup_value) is int:
+            return f'{prefix}{lookup_value}{suffix}'
+        return reverse(view_name, kwargs={lookup_url_kwarg: lookup_value},
+                       request=request, format=format)
+
+    if request is not None:
+        if formatters is None:
+            formatters = request._url_formatters = {}
+        formatters[cache_key] = format_url
+    return format_url
+
+
+class CachedUrlMixin:
+    """
+    Build the URLs of a hyperlinked field with get_url_formatter() instead of reverse().
+    """
+
+    def get_url(self, obj, view_name, request, format):
+        # Unsaved objects will not yet have a valid URL.
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        formatter = get_url_formatter(view_name, request, format, self.lookup_url_kwarg)
+        return formatter(getattr(obj, self.lookup_field))
+
+
+class CachedHyperlinkedIdentityField(CachedUrlMixin, serializers.HyperlinkedIdentityField):
+    pass
+
+
+class CachedHyperlinkedRelatedField(CachedUrlMixin, serializers.HyperlinkedRelatedField):
+    pass
+
+
+class BatchManyRelatedField(ManyRelatedField):
+    """
+    ManyRelatedField which hands the whole list over to the child relation at once.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_values(data)
+
+
+class BatchHyperlinkedRelatedField(CachedHyperlinkedRelatedField):
+    """
+    HyperlinkedRelatedField which, with many=True, parses all submitted URLs first and
+    then fetches the linked objects with a single query. Every invalid link is reported,
+    keyed by its index in the list.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BatchManyRelatedField(**list_kwargs)
+
+    def get_object(self, view_name, view_args, view_kwargs):
+        # Only the lookup value is taken from the URL, the objects are fetched together.
+        return view_kwargs[self.lookup_url_kwarg]
+
+    def to_internal_value(self, data):
+        try:
+            return self.to_internal_values([data])[0]
+        except serializers.ValidationError as e:
+            raise serializers.ValidationError(e.detail[0])
+
+    def to_internal_values(self, data):
+        queryset = self.get_queryset()
+        opts = queryset.model._meta
+        lookup_field = opts.pk if self.lookup_field == 'pk' else opts.get_field(self.lookup_field)
+        lookup_values = {}
+        errors = {}
+        for index, item in enumerate(data):
+            try:
+                lookup_values[index] = lookup_field.to_python(
+                    super().to_internal_value(item))
+            except serializers.ValidationError as e:
+                errors[index] = e.detail
+            except DjangoValidationError:
+                errors[index] = [self.error_messages['does_not_exist']]
+
+        objects = {
+            getattr(obj, self.lookup_field): obj
+            for obj in queryset.filter(**{
+                f'{self.lookup_field}__in': set(lookup_values.values())})
+        }
+        for index, lookup_value in lookup_values.items():
+            if lookup_value not in objects:
+                errors[index] = [self.error_messages['does_not_exist']]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return [objects[lookup_values[index]] for index in range(len(data))]
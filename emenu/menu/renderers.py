@@ -0,0 +1,60 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _to_primitive(obj):
+    """
+    Convert what the fast encoders do not know (decimals, datetimes, lazy strings, ...)
+    the same way DRF's JSONEncoder does.
+    """
+    return JSONEncoder().default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer which encodes with orjson when it is installed. The output is
+    the same as the compact output of JSONRenderer. Indented output, and the
+    settings orjson cannot follow, are left to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or not api_settings.UNICODE_JSON or not api_settings.COMPACT_JSON
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        # Datetimes go through _to_primitive(), which formats them like DRF does.
+        ret = orjson.dumps(data, default=_to_primitive,
+                           option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        # Escape the line separators, like JSONRenderer does, so that the output is valid JavaScript.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Render the same data as the JSON renderers in the MessagePack format.
+    It is enabled only when the msgpack package is installed.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_to_primitive, use_bin_type=True)
@@ -0,0 +1,72 @@
+from django.conf import settings
+from hashlib import md5
+from rest_framework.renderers import JSONOpenAPIRenderer
+from rest_framework.schemas.openapi import SchemaGenerator
+import json
+import os
+import time
+
+SCHEMA_INFO = {
+    'title': 'eMenu API',
+    'description': 'API for fetching and managing restaurant menu',
+    'version': '1.0.0',
+}
+
+_schema = None
+
+
+class CachedSchema:
+    """
+    The OpenAPI schema, with its renderings built once per renderer class.
+    """
+
+    def __init__(self, data, last_modified):
+        self.data = data
+        self.last_modified = int(last_modified)
+        self._renderings = {}
+
+    def render(self, renderer):
+        """
+        Return a (content, etag) tuple of the schema rendered by the renderer.
+        """
+        rendering = self._renderings.get(type(renderer))
+        if rendering is None:
+            content = renderer.render(self.data, renderer.media_type)
+            rendering = self._renderings[type(renderer)] = (
+                content, f'"{md5(content).hexdigest()}"')
+        return rendering
+
+
+def generate_schema():
+    """
+    Generate the public schema of all views, like the stock schema view does.
+    It goes through JSON, so that it is the same as the schema loaded from a file.
+    """
+    schema = SchemaGenerator(**SCHEMA_INFO).get_schema(request=None, public=True)
+    return json.loads(JSONOpenAPIRenderer().render(schema))
+
+
+def write_schema(path):
+    with open(path, 'wb') as file:
+        file.write(JSONOpenAPIRenderer().render(generate_schema()))
+
+
+def get_schema():
+    """
+    Return the CachedSchema of this process. It is loaded from OPENAPI_SCHEMA_FILE,
+    written by the build_openapi_schema command, or else generated on first use.
+    """
+    global _schema
+    if _schema is None:
+        path = settings.OPENAPI_SCHEMA_FILE
+        try:
+            with open(path, 'rb') as file:
+                _schema = CachedSchema(json.load(file), os.path.getmtime(path))
+        except FileNotFoundError:
+            _schema = CachedSchema(generate_schema(), time.time())
+    return _schema
+
+
+def clear_schema():
+    global _schema
+    _schema = None
@@ -0,0 +1,68 @@
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+from functools import reduce
+import operator
+import re
+
+SEARCH_CONFIG = 'english'
+
+
+def get_search_vector():
+    """
+    The weighted vector over name and description. The GIN indexes of migration
+    0005 are built on this exact expression, so that PostgreSQL can use them.
+    """
+    from django.contrib.postgres.search import SearchVector
+
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG) +
+            SearchVector('description', weight='B', config=SEARCH_CONFIG))
+
+
+def search(queryset, text, prefix=False):
+    """
+    Filter the queryset of a model with 'name' and 'description' fields down to
+    the rows matching the text, and annotate them with a relevance 'rank'.
+    With 'prefix', the last word matches also the longer words, as in an autocomplete.
+    """
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(queryset, text, prefix)
+    return _search_fallback(queryset, text)
+
+
+def _search_postgresql(queryset, text, prefix):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    if prefix:
+        # Only the word characters are kept, so the raw query cannot be malformed.
+        words = re.findall(r'\w+', text)
+        if not words:
+            return queryset.none()
+        words[-1] += ':*'
+        query = SearchQuery(' & '.join(words), config=SEARCH_CONFIG, search_type='raw')
+    else:
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    vector = get_search_vector()
+    # ts_rank() returns a real. As a double precision it survives the round trip
+    # through the pagination cursor exactly.
+    return queryset.alias(search_vector=vector).filter(search_vector=query).annotate(
+        rank=Cast(SearchRank(vector, query), FloatField()))
+
+
+def _search_fallback(queryset, text):
+    """
+    A portable approximation for databases without full-text search: every word has to
+    appear in the name or the description, and words found in the name weigh more.
+    """
+    words = text.split()
+    if not words:
+        return queryset.none()
+    matches = [Q(name__icontains=word) | Q(description__icontains=word) for word in words]
+    weights = [
+        Case(When(name__icontains=word, then=Value(1.0)),
+             When(description__icontains=word, then=Value(0.4)),
+             default=Value(0.0), output_field=FloatField())
+        for word in words
+    ]
+    return queryset.filter(reduce(operator.and_, matches)).annotate(
+        rank=reduce(operator.add, weights))
@@ -1,15 +1,58 @@
-from emenu.menu.models import Menu, Dish
+from emenu.menu.models import Change, Menu, Dish
+from emenu.menu.relations import BatchHyperlinkedRelatedField, CachedHyperlinkedIdentityField, CachedHyperlinkedRelatedField
 from rest_framework import serializers
 
 
-class DishSerializer(serializers.HyperlinkedModelSerializer):
+class CachedHyperlinkedModelSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    HyperlinkedModelSerializer which reverses the URL of each view once per request.
+    """
+    serializer_url_field = CachedHyperlinkedIdentityField
+    serializer_related_field = CachedHyperlinkedRelatedField
+
+
+class DishSerializer(CachedHyperlinkedModelSerializer):
     class Meta:
         model = Dish
         fields = ['url', 'name', 'description', 'price',
                   'preparation_time', 'date_added', 'date_modified', 'is_vegan']
 
 
-class PublicMenuDetailSerializer(serializers.HyperlinkedModelSerializer):
+class DishImportSerializer(serializers.ModelSerializer):
+    """
+    Validates a single row of a bulk dish import. Dishes are matched by name,
+    so the name does not have to be unique.
+    """
+    class Meta:
+        model = Dish
+        fields = ['name', 'description', 'price',
+                  'preparation_time', 'is_vegan']
+        extra_kwargs = {
+            'name': {
+                'validators': []
+            }
+        }
+
+
+class MenuDishesSerializer(serializers.Serializer):
+    """
+    The ids of the dishes to add to or remove from a menu. All dishes have to exist.
+    """
+    dishes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False)
+
+    def validate_dishes(self, value):
+        dish_ids = list(dict.fromkeys(value))
+        existing = set(Dish.objects.filter(
+            pk__in=dish_ids).values_list('pk', flat=True))
+        missing = [pk for pk in dish_ids if pk not in existing]
+        if missing:
+            raise serializers.ValidationError(
+                f"Dishes do not exist: {', '.join(map(str, missing))}.")
+        return dish_ids
+
+
+class PublicMenuDetailSerializer(CachedHyperlinkedModelSerializer):
     dishes = DishSerializer(many=True)
 
     class Meta:
@@ -23,7 +66,7 @@ class PublicMenuDetailSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class PublicMenuSimpleSerializer(serializers.HyperlinkedModelSerializer):
+class PublicMenuSimpleSerializer(CachedHyperlinkedModelSerializer):
     dishes = serializers.StringRelatedField(many=True)
 
     class Meta:
@@ -37,8 +80,8 @@ class PublicMenuSimpleSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class PrivateMenuSerializer(serializers.HyperlinkedModelSerializer):
-    dishes = serializers.HyperlinkedRelatedField(
+class PrivateMenuSerializer(CachedHyperlinkedModelSerializer):
+    dishes = BatchHyperlinkedRelatedField(
         many=True, allow_null=True, queryset=Dish.objects.all(), view_name='dish-detail')
 
     class Meta:
@@ -50,3 +93,22 @@ class PrivateMenuSerializer(serializers.HyperlinkedModelSerializer):
                 'view_name': 'private-menu-detail'
             }
         }
+
+
+class MenuChangeSerializer(serializers.ModelSerializer):
+    """
+    The last change of a menu in the change feed. Deleted menus have no URL.
+    """
+    pk = serializers.IntegerField(source='object_id')
+    url = CachedHyperlinkedIdentityField(
+        view_name='public-menu-detail', lookup_field='object_id', lookup_url_kwarg='pk')
+
+    class Meta:
+        model = Change
+        fields = ['url', 'pk', 'action', 'date']
+
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+        if instance.action == Change.DELETED:
+            ret['url'] = None
+        return ret
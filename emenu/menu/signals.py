@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from emenu.menu.cache import invalidate_menus
+from emenu.menu.changes import log_changes
+from emenu.menu.models import Change, Dish, Menu
+from emenu.menu.snapshots import discard_snapshots
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def menus_changed(menu_pks):
+    """
+    Drop everything derived from the public documents of the given menus:
+    the cached responses and the stored snapshots, which are rebuilt after commit.
+    """
+    menu_pks = list(set(menu_pks))
+    if not menu_pks:
+        return
+    invalidate_menus(menu_pks)
+    if settings.PUBLIC_MENU_SNAPSHOTS:
+        discard_snapshots(menu_pks)
+        transaction.on_commit(lambda: _schedule_snapshot_rebuild(menu_pks))
+
+
+def _schedule_snapshot_rebuild(menu_pks):
+    from emenu.menu.tasks import rebuild_menu_snapshots
+
+    try:
+        rebuild_menu_snapshots.delay(menu_pks)
+    except Exception:
+        # The public endpoints serialize menus without a snapshot live, so
+        # the failure only costs performance until the next rebuild.
+        logger.exception('Could not schedule the rebuild of menu snapshots %s', menu_pks)
+
+
+def dishes_of_menus_changed(menu_pks):
+    """
+    The dishes of the given menus, or their contents, changed: log it and drop the derived data.
+    """
+    menu_pks = set(menu_pks)
+    log_changes(Change.MENU, Change.UPDATED, menu_pks)
+    menus_changed(menu_pks)
+
+
+def _get_menu_pks_of_dish(dish):
+    return list(Menu.dishes.through.objects.filter(
+        dish_id=dish.pk).values_list('menu_id', flat=True))
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def saved_menu_changed(sender, instance, **kwargs):
+    menus_changed([instance.pk])
+
+
+@receiver(post_save, sender=Dish)
+@receiver(post_save, sender=Menu)
+def log_saved_object(sender, instance, created, **kwargs):
+    model = Change.DISH if sender is Dish else Change.MENU
+    log_changes(model, Change.CREATED if created else Change.UPDATED, [instance.pk])
+
+
+@receiver(post_delete, sender=Dish)
+@receiver(post_delete, sender=Menu)
+def log_deleted_object(sender, instance, **kwargs):
+    model = Change.DISH if sender is Dish else Change.MENU
+    log_changes(model, Change.DELETED, [instance.pk])
+
+
+@receiver(post_save, sender=Dish)
+def menus_of_saved_dish_changed(sender, instance, created, **kwargs):
+    if not created:
+        dishes_of_menus_changed(_get_menu_pks_of_dish(instance))
+
+
+@receiver(pre_delete, sender=Dish)
+def remember_menus_of_deleted_dish(sender, instance, **kwargs):
+    # The relations are gone by the time post_delete is sent.
+    instance._menu_pks_before_delete = _get_menu_pks_of_dish(instance)
+
+
+@receiver(post_delete, sender=Dish)
+def update_menus_of_deleted_dish(sender, instance, **kwargs):
+    menu_pks = getattr(instance, '_menu_pks_before_delete', [])
+    if menu_pks:
+        Menu.objects.filter(pk__in=menu_pks).update_dish_counts()
+        dishes_of_menus_changed(menu_pks)
+
+
+@receiver(m2m_changed, sender=Menu.dishes.through)
+def update_changed_menu_dishes(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._menu_pks_before_clear = _get_menu_pks_of_dish(instance)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        menu_pks = [instance.pk]
+    elif action == 'post_clear':
+        menu_pks = getattr(instance, '_menu_pks_before_clear', [])
+    else:
+        menu_pks = pk_set
+    if not menu_pks:
+        return
+
+    Menu.objects.filter(pk__in=menu_pks).update_dish_counts()
+    if not reverse:
+        instance.refresh_from_db(fields=['dish_count'])
+    dishes_of_menus_changed(menu_pks)
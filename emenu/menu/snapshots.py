@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models import Max
+from django.http import HttpResponse
+from emenu.menu.fast_serializers import FastPublicMenuSerializer
+from emenu.menu.models import Change, Menu, MenuSnapshot
+from emenu.menu.renderers import FastJSONRenderer
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+# Snapshots are rendered without a request, so their URLs are relative.
+RELATIVE_URL_MARKER = b'"url":"/'
+
+
+def render_json(data):
+    return FastJSONRenderer().render(data)
+
+
+def build_snapshots(menu_pks=None, chunk_size=500):
+    """
+    Render and store the snapshots of the given menus, or of all menus.
+    Returns the number of rendered snapshots.
+
+    Every snapshot keeps the id of the last change of its menu read before rendering it,
+    and never replaces a snapshot of a later change, so that of two concurrent rebuilds
+    the one which read the older data cannot commit last and leave it stale.
+    """
+    menus = Menu.objects.order_by('pk')
+    if menu_pks is not None:
+        menus = menus.filter(pk__in=menu_pks)
+    menu_pks = list(menus.values_list('pk', flat=True))
+    detail_serializer = FastPublicMenuSerializer(None, detail=True)
+    list_serializer = FastPublicMenuSerializer(None)
+    for start in range(0, len(menu_pks), chunk_size):
+        chunk_pks = menu_pks[start:start + chunk_size]
+        change_ids = dict(Change.objects.filter(model=Change.MENU, object_id__in=chunk_pks).values(
+            'object_id').annotate(latest=Max('id')).values_list('object_id', 'latest'))
+        rows = list(detail_serializer.get_menu_values(menus.filter(pk__in=chunk_pks)))
+        snapshots = [
+            MenuSnapshot(menu_id=detail['pk'], detail=render_json(detail),
+                         list_item=render_json(list_item),
+                         change_id=change_ids.get(detail['pk'], 0))
+            for detail, list_item in zip(detail_serializer.to_representation(rows),
+                                         list_serializer.to_representation(rows))
+        ]
+        with transaction.atomic():
+            # The menu rows serialize the rebuilds of the same menus.
+            list(Menu.objects.select_for_update().filter(pk__in=chunk_pks).order_by(
+                'pk').values_list('pk', flat=True))
+            stored_change_ids = dict(MenuSnapshot.objects.filter(menu_id__in=chunk_pks).values_list(
+                'menu_id', 'change_id'))
+            snapshots = [snapshot for snapshot in snapshots
+                         if stored_change_ids.get(snapshot.menu_id, 0) <= snapshot.change_id]
+            MenuSnapshot.objects.filter(
+                menu_id__in=[snapshot.menu_id for snapshot in snapshots]).delete()
+            MenuSnapshot.objects.bulk_create(snapshots)
+    return len(menu_pks)
+
+
+def discard_snapshots(menu_pks):
+    MenuSnapshot.objects.filter(menu_id__in=menu_pks).delete()
+
+
+def can_serve_snapshot(request):
+    """
+    Snapshots are stored as compact JSON, so they can only answer plain JSON requests.
+    The URLs of a request with a format override keep it, unlike the stored ones.
+    """
+    return (isinstance(request.accepted_renderer, JSONRenderer) and
+            'indent' not in request.accepted_media_type and
+            api_settings.URL_FORMAT_OVERRIDE not in request.query_params)
+
+
+def make_absolute(content, request):
+    base_url = request.build_absolute_uri('/').encode('utf-8')
+    return content.replace(RELATIVE_URL_MARKER, b'"url":"' + base_url)
+
+
+def get_snapshot_response(content, request):
+    return HttpResponse(make_absolute(bytes(content), request),
+                        content_type=request.accepted_renderer.media_type)
@@ -1,48 +1,140 @@
-from datetime import datetime, timedelta, date
 from celery import shared_task
-from django.template.loader import render_to_string
-from django.core.mail import EmailMessage
+from django.conf import settings
+from django.template.loader import get_template, render_to_string
+from django.core.mail import EmailMessage, get_connection
 from django.contrib.auth.models import User
 from django.utils import timezone
-from emenu.menu.models import Dish
+from django.utils.safestring import mark_safe
+from emenu.menu.changes import get_settled_change_id, get_watermark, set_watermark
+from emenu.menu.models import Change, Dish
+from emenu.menu.snapshots import build_snapshots
+from smtplib import SMTPException
 
 
-def get_new_dishes_mail_contents():
+NEW_DISHES_MAIL_WATERMARK = 'new-dishes-mail'
+
+
+def get_dish_changes(since, until):
     """
-    Prepare emails that notify users of yesterday's changes to dishes.
-    Returns a list of tuples (user_email, mail_content) to send.
+    Returns a tuple of querysets (added_dishes, modified_dishes) with the existing dishes
+    added or modified by the changes with ids in the (since, until] window of the change log.
+    Modified dishes exclude the added ones.
     """
-    today = date.today()
-    yesterday = today - timedelta(days=1)
-    newly_added_dishes = Dish.objects.filter(date_added__gte=yesterday,
-                                             date_added__lt=today)
-    newly_modified_dishes = Dish.objects.filter(date_modified__gte=yesterday,
-                                                date_modified__lt=today).exclude(id__in=newly_added_dishes)
+    changes = Change.objects.filter(model=Change.DISH, id__gt=since, id__lte=until)
+    added_ids = changes.filter(action=Change.CREATED).values('object_id')
+    modified_ids = changes.filter(action=Change.UPDATED).values('object_id')
+    added_dishes = Dish.objects.filter(id__in=added_ids)
+    modified_dishes = Dish.objects.filter(id__in=modified_ids).exclude(id__in=added_ids)
+    return added_dishes, modified_dishes
+
+
+def get_dish_updates(since, until):
+    """
+    Render the list of the dishes added or modified by the changes in the (since, until]
+    window of the change log, shared by the mails of all users. Returns None without updates.
+    """
+    newly_added_dishes, newly_modified_dishes = get_dish_changes(since, until)
+    newly_added_dishes = list(newly_added_dishes.only('name'))
+    newly_modified_dishes = list(newly_modified_dishes.only('name'))
+
+    if not newly_added_dishes and not newly_modified_dishes:
+        return None
 
-    if newly_added_dishes.count() + newly_modified_dishes.count() == 0:
-        # No updates.
-        return []
+    return render_to_string('menu/new-dishes-mail-updates.html', context={
+        'newly_added_dishes': newly_added_dishes,
+        'newly_modified_dishes': newly_modified_dishes,
+    })
 
-    results = []
-    for user in User.objects.all():
+
+def get_mail_recipients():
+    """
+    Yields tuples (user_email, user_greeting_name) of all users.
+    The users are streamed from the database in chunks.
+    """
+    users = User.objects.only('email', 'first_name', 'username').order_by('pk').iterator(
+        chunk_size=settings.NEW_DISHES_MAIL_CHUNK_SIZE)
+    for user in users:
         user_greeting_name = user.first_name
         if user_greeting_name == "":
             user_greeting_name = user.username
+        yield user.email, user_greeting_name
+
+
+def render_new_dishes_mail(template, dish_updates, user_greeting_name):
+    return template.render(context={
+        'dish_updates': dish_updates,
+        'user_greeting_name': user_greeting_name,
+    })
+
+
+def get_new_dishes_mail_contents(since, until):
+    """
+    Prepare emails that notify users of the changes to dishes in the (since, until]
+    window of the change log. Yields tuples (user_email, mail_content) to send.
+
+    The list of changed dishes is rendered once, only the greeting differs between users.
+    """
+    dish_updates = get_dish_updates(since, until)
+    if dish_updates is None:
+        return
 
-        message = render_to_string('menu/new-dishes-mail.html', context={
-            'newly_added_dishes': newly_added_dishes,
-            'newly_modified_dishes': newly_modified_dishes,
-            'user_greeting_name': user_greeting_name,
-        })
-        results.append((user.email, message))
-    return results
+    template = get_template('menu/new-dishes-mail.html')
+    for user_email, user_greeting_name in get_mail_recipients():
+        yield user_email, render_new_dishes_mail(template, dish_updates, user_greeting_name)
 
 
 @shared_task
 def schedule_new_dishes_mail():
+    """
+    Split the dish updates mails into chunks, each sent by its own subtask as soon as it
+    fills up. A subtask gets the shared list of updated dishes once, with the email and
+    the greeting of each of its users, and renders their mails itself.
+    The mails cover the changes logged since the previous run, so a missed or
+    repeated run neither loses nor repeats updates. The changes younger than
+    CHANGE_LOG_SAFETY_LAG are left to the next run.
+    """
+    since = get_watermark(NEW_DISHES_MAIL_WATERMARK)
+    until = max(since, get_settled_change_id())
+    dish_updates = get_dish_updates(since, until)
+    if dish_updates is not None:
+        chunk_size = settings.NEW_DISHES_MAIL_CHUNK_SIZE
+        chunk = []
+        for recipient in get_mail_recipients():
+            chunk.append(recipient)
+            if len(chunk) == chunk_size:
+                send_new_dishes_mail_chunk.delay(dish_updates, chunk)
+                chunk = []
+        if chunk:
+            send_new_dishes_mail_chunk.delay(dish_updates, chunk)
+    set_watermark(NEW_DISHES_MAIL_WATERMARK, until)
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
+def send_new_dishes_mail_chunk(self, dish_updates, recipients):
+    """
+    Send the dish updates mails to a chunk of (user_email, user_greeting_name) recipients
+    through a single mail connection.
+    On failure, only the mails that were not sent yet are retried.
+    """
     mail_subject = 'eMenu - Dish updates'
-    emails_and_contents = get_new_dishes_mail_contents()
-    for user_email, message in emails_and_contents:
-        email = EmailMessage(mail_subject, message, to=[user_email])
-        email.content_subtype = 'html'
-        email.send()
+    template = get_template('menu/new-dishes-mail.html')
+    # The list was rendered by the scheduling task, but arrives as a plain string.
+    dish_updates = mark_safe(dish_updates)
+    with get_connection() as connection:
+        for sent, (user_email, user_greeting_name) in enumerate(recipients):
+            message = render_new_dishes_mail(template, dish_updates, user_greeting_name)
+            email = EmailMessage(mail_subject, message, to=[user_email],
+                                 connection=connection)
+            email.content_subtype = 'html'
+            try:
+                connection.send_messages([email])
+            except (SMTPException, OSError) as exc:
+                raise self.retry(args=[dish_updates, recipients[sent:]], exc=exc)
+
+
+@shared_task
+def rebuild_menu_snapshots(menu_pks=None):
+    """
+    Rebuild the stored public documents of the given menus, or of all menus.
+    """
+    return build_snapshots(menu_pks)
@@ -1,20 +1,71 @@
 from datetime import date, timedelta
-from emenu.menu.models import Dish
+from decimal import Decimal
+from emenu.menu.cache import get_cache
+from emenu.menu.checks import check_public_menu_cache
+from emenu.menu.changes import get_changes, get_latest_change_id, get_watermark, log_changes, set_watermark
+from emenu.menu.models import Change, Dish, Menu, MenuSnapshot
+from emenu.menu.snapshots import build_snapshots
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from django.contrib.auth.models import User
-from django.test import TestCase
-from emenu.menu.tasks import get_new_dishes_mail_contents
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail.backends.locmem import EmailBackend as LocMemEmailBackend
+from django.core.management import CommandError, call_command
+from celery.fixups.django import DjangoWorkerFixup
+from django.core.signals import request_finished
+from django.db import OperationalError, connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from emenu.db.pool import PooledDatabaseWrapperMixin, close_pools
+from emenu.db.routers import PIN_COOKIE
+from emenu.menu.export import iter_menu_chunks
+from emenu.menu.filters import MenuFilter
+from emenu.menu.relations import get_url_formatter
+from emenu.menu.renderers import FastJSONRenderer
+from emenu.menu.schema import SCHEMA_INFO, clear_schema, generate_schema
+from emenu.menu.serializers import PublicMenuDetailSerializer
+from emenu.menu.throttling import CounterRateThrottle
+from emenu import celery_app
+from emenu.menu.tasks import NEW_DISHES_MAIL_WATERMARK, get_dish_changes, get_new_dishes_mail_contents, schedule_new_dishes_mail, send_new_dishes_mail_chunk
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse as drf_reverse
+from rest_framework.schemas import get_schema_view
+from rest_framework.schemas.openapi import SchemaGenerator
+from rest_framework.test import APIRequestFactory, APITestCase
+from io import StringIO
+from smtplib import SMTPException
+from unittest import mock, skipUnless
+import base64
+import csv
 import json
+import msgpack
+import os
+import tempfile
 import re
 
 
+def create_dishes(names, using='default'):
+    """
+    Insert dishes with the given names in bulk, without sending signals.
+    """
+    Dish.objects.using(using).bulk_create([
+        Dish(name=name, description='A dish.', price='10.00',
+             preparation_time=timedelta(minutes=10))
+        for name in names
+    ])
+
+
 class PublicApiTests(APITestCase):
     fixtures = ['testing.json']
 
+    def setUp(self):
+        get_cache().clear()
+
     def test_root_view_contains_link_to_documentation(self):
         url = reverse('root')
         response = self.client.get(url)
@@ -59,11 +110,17 @@ class PublicApiTests(APITestCase):
         # 'August' is before 'September' in dictionary
         self.__assert_before('August Menu', 'September Menu', response)
 
+    def test_ordering_menus_by_dish_count_alias(self):
+        old = self.client.get(reverse('public-menu-list') + '?ordering=-dishes__count,name')
+        new = self.client.get(reverse('public-menu-list') + '?ordering=-dish_count,name')
+        self.assertEqual(json.loads(old.content)['results'],
+                         json.loads(new.content)['results'])
+
     def test_filtering_menu_exact_name(self):
         url = reverse('public-menu-list') + '?name=October+Menu'
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        json_response = json.loads(response.content)
+        json_response = json.loads(response.content)['results']
         self.assertEqual(len(json_response), 1)
         self.assertEqual(json_response[0]['name'], 'October Menu')
 
@@ -71,17 +128,912 @@ class PublicApiTests(APITestCase):
         url = reverse('public-menu-list') + '?name=nonexistentmenu'
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        json_response = json.loads(response.content)
+        json_response = json.loads(response.content)['results']
         self.assertEqual(len(json_response), 0)
 
     def test_filtering_menu_date_added(self):
         url = reverse('public-menu-list') + \
             '?date_added__lt=2021-09-13&date_added__gte=2021-09-12'
         response = self.client.get(url, format='json')
-        json_response = json.loads(response.content)
+        json_response = json.loads(response.content)['results']
         self.assertEqual(len(json_response), 2)
 
 
+class PaginationTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        get_cache().clear()
+
+    def __collect_names(self, url):
+        names = []
+        while url is not None:
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            json_response = json.loads(response.content)
+            self.assertLessEqual(len(json_response['results']), 1)
+            names += [menu['name'] for menu in json_response['results']]
+            url = json_response['next']
+        return names
+
+    def test_walking_pages_by_dish_count(self):
+        url = reverse('public-menu-list') + '?ordering=-dishes__count,name&page_size=1'
+        full_url = reverse('public-menu-list') + '?ordering=-dishes__count,name'
+        all_names = [menu['name'] for menu in
+                     json.loads(self.client.get(full_url).content)['results']]
+        self.assertEqual(self.__collect_names(url), all_names)
+
+    def test_walking_pages_with_filter(self):
+        url = reverse('public-menu-list') + \
+            '?date_added__lt=2021-09-13&date_added__gte=2021-09-12&ordering=name&page_size=1'
+        self.assertEqual(len(self.__collect_names(url)), 2)
+
+    def test_previous_link_returns_previous_page(self):
+        url = reverse('public-menu-list') + '?ordering=name&page_size=1'
+        first_page = json.loads(self.client.get(url).content)
+        second_page = json.loads(self.client.get(first_page['next']).content)
+        self.assertIsNone(first_page['previous'])
+        response = json.loads(self.client.get(second_page['previous']).content)
+        self.assertEqual(response['results'], first_page['results'])
+
+    def test_invalid_cursor(self):
+        url = reverse('public-menu-list') + '?cursor=garbage'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_forged_cursors(self):
+        ordering = ['-dish_count', 'name', 'pk']
+        for tokens in [{'r': 0, 'o': ordering, 'p': ['abc', 'Menu', 1]},
+                       {'r': 0, 'o': ordering, 'p': [{'x': 1}, 'Menu', 1]},
+                       {'r': 0, 'o': ordering, 'p': [None, 'Menu', 1]},
+                       {'r': 0, 'o': ordering, 'p': [1, ['Menu'], 1]},
+                       {'r': 0, 'p': [1, 'Menu', 1]},
+                       [{'x': 1}], [None], 'abc']:
+            cursor = base64.b64encode(json.dumps(tokens).encode('utf-8')).decode('ascii')
+            response = self.client.get(reverse('public-menu-list'),
+                                       {'ordering': '-dishes__count,name', 'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, tokens)
+
+    def test_cursor_of_other_ordering(self):
+        url = reverse('public-menu-list') + '?ordering=name&page_size=1'
+        next_url = json.loads(self.client.get(url).content)['next']
+        response = self.client.get(next_url.replace('ordering=name', 'ordering=-dishes__count'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DishFilterTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        get_cache().clear()
+        build_snapshots()
+
+    def __get(self, url, params):
+        response = self.client.get(url, params, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    def test_filtering_menus_by_dishes(self):
+        results = self.__get(reverse('public-menu-list'), {
+            'is_vegan': 'true', 'price__lte': '10', 'preparation_time__lte': '00:15:00',
+            'ordering': 'name'})['results']
+        self.assertEqual([menu['name'] for menu in results], ['October Menu', 'September Menu'])
+        self.assertEqual([menu['dishes'] for menu in results],
+                         [['French fries', 'Tap water'], ['French fries']])
+
+    def test_dish_filters_hold_for_the_same_dish(self):
+        # There are non-vegan dishes and dishes under 10 PLN, but no non-vegan dish under 10 PLN.
+        results = self.__get(reverse('public-menu-list'),
+                             {'is_vegan': 'false', 'price__lte': '10'})['results']
+        self.assertEqual(results, [])
+
+    def test_filtering_dishes_of_menu_details(self):
+        url = reverse('public-menu-detail', kwargs={'pk': 2})
+        dishes = self.__get(url, {'is_vegan': 'false'})['dishes']
+        self.assertEqual([dish['name'] for dish in dishes], ['Grilled chicken'])
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}),
+                                   {'is_vegan': 'false'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_filtered_menus_are_identical_without_fast_serialization(self):
+        params = {'is_vegan': 'true', 'price__gte': '10'}
+        for url in [reverse('public-menu-list'), reverse('public-menu-detail', kwargs={'pk': 3})]:
+            fast = self.__get(url, params)
+            get_cache().clear()
+            with self.settings(PUBLIC_FAST_SERIALIZATION=False):
+                self.assertEqual(self.__get(url, params), fast)
+
+    def test_filtered_menu_list_query_count(self):
+        # One query for the page of menus and one for their matching dishes.
+        with self.assertNumQueries(2):
+            self.__get(reverse('public-menu-list'), {'is_vegan': 'true'})
+
+    def test_invalid_dish_filter(self):
+        response = self.client.get(reverse('public-menu-list'), {'price__lte': 'cheap'},
+                                   format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(PUBLIC_MENU_SNAPSHOTS=False)
+class QueryCountTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+
+    def __create_menus(self, count, dishes_per_menu=3):
+        create_dishes(f'Dish {i}' for i in range(dishes_per_menu))
+        Menu.objects.bulk_create([
+            Menu(name=f'Menu {i}', description='A menu.') for i in range(count)
+        ])
+        dish_ids = list(Dish.objects.values_list('pk', flat=True))
+        Menu.dishes.through.objects.bulk_create([
+            Menu.dishes.through(menu_id=menu_id, dish_id=dish_id)
+            for menu_id in Menu.objects.values_list('pk', flat=True)
+            for dish_id in dish_ids
+        ])
+        # Bulk inserts bypass the signals, so the counts are rebuilt by hand.
+        Menu.objects.update_dish_counts()
+
+    def __assert_list_query_count(self, url_name, menus_count):
+        self.__create_menus(menus_count)
+        url = reverse(url_name) + '?page_size=500'
+        # One query for the page of menus and one for their dishes.
+        with self.assertNumQueries(2):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)['results']),
+                         min(menus_count, 500))
+
+    def test_public_menu_list_query_count_100_menus(self):
+        self.__assert_list_query_count('public-menu-list', 100)
+
+    def test_public_menu_list_query_count_1000_menus(self):
+        self.__assert_list_query_count('public-menu-list', 1000)
+
+    def test_private_menu_list_query_count_1000_menus(self):
+        User.objects.create_user(username='Eve', password='abc')
+        self.client.force_authenticate(User.objects.get(username='Eve'))
+        self.__assert_list_query_count('private-menu-list', 1000)
+
+    def test_public_menu_detail_query_count(self):
+        self.__create_menus(1, dishes_per_menu=100)
+        url = reverse('public-menu-detail',
+                      kwargs={'pk': Menu.objects.get().pk})
+        with self.assertNumQueries(2):
+            response = self.client.get(url, format='json')
+        self.assertEqual(len(json.loads(response.content)['dishes']), 100)
+
+
+@override_settings(PUBLIC_MENU_SNAPSHOTS=False)
+class PublicCacheTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        get_cache().clear()
+        # Warm up the cache of every menu and of the list.
+        self.client.get(reverse('public-menu-list'))
+        for menu in Menu.objects.all():
+            self.client.get(reverse('public-menu-detail', kwargs={'pk': menu.pk}))
+
+    def test_cached_responses_run_no_queries(self):
+        with self.assertNumQueries(0):
+            self.client.get(reverse('public-menu-list'))
+            self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}))
+
+    def test_editing_dish_evicts_only_its_menus(self):
+        french_fries = Dish.objects.get(pk=1)
+        menus_with_dish = set(french_fries.menu_set.all())
+        french_fries.name = 'Curly fries'
+        french_fries.save()
+
+        response = self.client.get(reverse('public-menu-list'))
+        self.assertContains(response, 'Curly fries')
+        for menu in Menu.objects.all():
+            with self.assertNumQueries(2 if menu in menus_with_dish else 0):
+                self.client.get(reverse('public-menu-detail', kwargs={'pk': menu.pk}))
+
+    def test_deleting_dish_evicts_its_menus(self):
+        Dish.objects.get(pk=1).delete()
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}))
+        self.assertNotContains(response, 'French fries')
+
+    def test_changing_menu_dishes_evicts_menu(self):
+        menu = Menu.objects.get(pk=1)
+        menu.dishes.clear()
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}))
+        self.assertEqual(json.loads(response.content)['dishes'], [])
+
+        Dish.objects.get(pk=2).menu_set.add(menu)
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}))
+        self.assertContains(response, 'Greek salad')
+
+    def test_renaming_menu_evicts_menu(self):
+        menu = Menu.objects.get(pk=1)
+        menu.name = 'Renamed Menu'
+        menu.save()
+        self.assertContains(self.client.get(reverse('public-menu-list')), 'Renamed Menu')
+        self.assertContains(self.client.get(
+            reverse('public-menu-detail', kwargs={'pk': 1})), 'Renamed Menu')
+
+    def test_deploy_check_warns_about_local_cache(self):
+        self.assertEqual([warning.id for warning in check_public_menu_cache(None)], ['menu.W001'])
+        with override_settings(DEBUG=True):
+            self.assertEqual(check_public_menu_cache(None), [])
+        for backend in ('django.core.cache.backends.memcached.PyMemcacheCache',
+                        'django.core.cache.backends.dummy.DummyCache'):
+            with override_settings(CACHES={**settings.CACHES, 'default': {'BACKEND': backend}}):
+                self.assertEqual(check_public_menu_cache(None), [])
+
+
+class DishCountTests(TestCase):
+    fixtures = ['testing.json']
+
+    def __assert_counts_exact(self):
+        for menu in Menu.objects.all():
+            self.assertEqual(menu.dish_count, menu.dishes.count(), menu.name)
+
+    def test_fixture_counts_are_exact(self):
+        self.__assert_counts_exact()
+
+    def test_count_follows_adding_and_removing_dishes(self):
+        menu = Menu.objects.get(pk=1)
+        menu.dishes.add(Dish.objects.get(pk=6))
+        self.__assert_counts_exact()
+        menu.dishes.remove(Dish.objects.get(pk=1))
+        self.__assert_counts_exact()
+        menu.dishes.clear()
+        self.assertEqual(menu.dish_count, 0)
+        self.__assert_counts_exact()
+
+    def test_count_follows_reverse_changes(self):
+        dish = Dish.objects.get(pk=1)
+        dish.menu_set.clear()
+        self.__assert_counts_exact()
+        dish.menu_set.add(*Menu.objects.all())
+        self.__assert_counts_exact()
+
+    def test_count_follows_dish_deletion(self):
+        Dish.objects.get(pk=1).delete()
+        self.__assert_counts_exact()
+
+    def test_saving_stale_menu_keeps_count(self):
+        menu = Menu.objects.get(pk=1)
+        Menu.objects.get(pk=1).dishes.add(Dish.objects.get(pk=6))
+        menu.name = 'Renamed Menu'
+        menu.save()
+        self.assertEqual(Menu.objects.get(pk=1).name, 'Renamed Menu')
+        self.__assert_counts_exact()
+
+    def test_rebuild_command(self):
+        Menu.objects.filter(pk=1).update(dish_count=0)
+        since = get_latest_change_id()
+        with mock.patch('emenu.menu.signals.invalidate_menus') as invalidate_menus:
+            call_command('rebuild_dish_counts', stdout=StringIO())
+        self.__assert_counts_exact()
+        # Only the menu with the wrong count changed.
+        invalidate_menus.assert_called_once_with([1])
+        changes, _, _ = get_changes(Change.MENU, since, 10)
+        self.assertEqual([change.object_id for change in changes], [1])
+
+
+class BulkDishImportTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        User.objects.create_user(username='Eve', password='abc')
+        self.assertTrue(self.client.login(username='Eve', password='abc'))
+
+    def __dish_row(self, name, price='9.90'):
+        return {'name': name, 'description': 'Imported.', 'price': price,
+                'preparation_time': '00:10:00', 'is_vegan': False}
+
+    def test_bulk_upsert_from_json_array(self):
+        rows = [self.__dish_row('French fries', price='7.00'),
+                self.__dish_row('Risotto'),
+                self.__dish_row('Broken', price='not a price'),
+                self.__dish_row('Risotto')]
+        response = self.client.post(reverse('dish-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        json_response = json.loads(response.content)
+        self.assertEqual(json_response['created'], 1)
+        self.assertEqual(json_response['updated'], 1)
+        self.assertEqual([error['row'] for error in json_response['errors']], [2, 3])
+        self.assertIn('price', json_response['errors'][0]['errors'])
+        self.assertEqual(str(Dish.objects.get(name='French fries').price), '7.00')
+        self.assertTrue(Dish.objects.filter(name='Risotto').exists())
+
+    def test_bulk_upsert_from_ndjson(self):
+        body = '\n'.join(json.dumps(self.__dish_row(f'Dish {i}')) for i in range(3))
+        response = self.client.post(reverse('dish-bulk'), body,
+                                    content_type='application/x-ndjson')
+        self.assertEqual(json.loads(response.content)['created'], 3)
+
+    def test_malformed_ndjson_is_rejected(self):
+        response = self.client.post(reverse('dish-bulk'), '{"name": "Soup"}\n{',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Dish.objects.filter(name='Soup').exists())
+
+    def test_bulk_upsert_query_count_does_not_grow_with_rows(self):
+        self.client.force_authenticate(User.objects.get(username='Eve'))
+        rows = [self.__dish_row(f'Dish {i}') for i in range(100)]
+        rows += [self.__dish_row(dish.name) for dish in Dish.objects.all()]
+        # Savepoint, lookup, insert, lookup of the created ids, update, lookup of the
+        # changed menus, insert into the change log, deletion of their snapshots and release.
+        with self.assertNumQueries(9):
+            response = self.client.post(reverse('dish-bulk'), rows, format='json')
+        self.assertEqual(json.loads(response.content)['created'], 100)
+
+    def test_bulk_upsert_logs_changes(self):
+        since = get_latest_change_id()
+        rows = [self.__dish_row('French fries', price='7.00'), self.__dish_row('Risotto')]
+        self.client.post(reverse('dish-bulk'), rows, format='json')
+        changes = Change.objects.filter(id__gt=since)
+        self.assertEqual(
+            set(changes.values_list('model', 'object_id', 'action')),
+            {(Change.DISH, 1, Change.UPDATED),
+             (Change.DISH, Dish.objects.get(name='Risotto').pk, Change.CREATED),
+             (Change.MENU, 1, Change.UPDATED), (Change.MENU, 3, Change.UPDATED)})
+
+    def test_repeated_import_logs_no_changes(self):
+        rows = [self.__dish_row('French fries', price='7.00'), self.__dish_row('Risotto')]
+        self.client.post(reverse('dish-bulk'), rows, format='json')
+        since = get_latest_change_id()
+        date_modified = Dish.objects.get(name='French fries').date_modified
+
+        response = self.client.post(reverse('dish-bulk'), rows, format='json')
+        self.assertEqual(json.loads(response.content),
+                         {'created': 0, 'updated': 0, 'unchanged': 2, 'errors': []})
+        self.assertEqual(get_latest_change_id(), since)
+        self.assertEqual(Dish.objects.get(name='French fries').date_modified, date_modified)
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as file:
+            file.write(json.dumps(self.__dish_row('Risotto')) + '\n')
+            file.flush()
+            call_command('import_dishes', file.name, stdout=StringIO())
+        self.assertTrue(Dish.objects.filter(name='Risotto').exists())
+
+
+class CatalogExportTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        User.objects.create_user(username='Eve', password='abc')
+        self.client.force_authenticate(User.objects.get(username='Eve'))
+
+    def test_export_inaccessible_to_public(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('catalog-export'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_ndjson_export(self):
+        response = self.client.get(reverse('catalog-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        menus = [json.loads(line) for line in
+                 b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(menus), Menu.objects.count())
+        detail = self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}))
+        self.assertEqual(menus[0], json.loads(detail.content))
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('catalog-export') + '?export_format=csv')
+        rows = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:2], ['menu_pk', 'menu_name'])
+        self.assertIn('dish_price', rows[0])
+        empty_menus = Menu.objects.filter(dish_count=0).count()
+        self.assertEqual(len(rows) - 1, Menu.dishes.through.objects.count() + empty_menus)
+
+    def test_unknown_export_format(self):
+        response = self.client.get(reverse('catalog-export') + '?export_format=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_prefetches_per_chunk(self):
+        chunks = (Menu.objects.count() + 1) // 2
+        # One streamed query for the menus and one dishes query per chunk of two menus.
+        with self.assertNumQueries(1 + chunks):
+            for chunk in iter_menu_chunks(chunk_size=2):
+                self.assertLessEqual(len(chunk), 2)
+                for menu in chunk:
+                    list(menu.dishes.all())
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_catalog', export_format='ndjson', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), Menu.objects.count())
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_command_reports_all_endpoints_and_rolls_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('benchmark', menus=5, dishes=10, menu_size=3, users=3, repeat=2,
+                         output=output, stdout=StringIO(), stderr=StringIO())
+            with open(output) as file:
+                report = json.load(file)
+            # Comparing the results with themselves finds no regressions.
+            call_command('benchmark', menus=5, dishes=10, menu_size=3, users=3, repeat=2,
+                         baseline=output, tolerance=float('inf'),
+                         stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(report['config']['menus'], 5)
+        for name in ('public-menu-list', 'public-menu-search', 'public-dish-search',
+                     'public-menu-changes'):
+            self.assertIn(name, report['results'])
+        self.assertIn('new-dishes-mail-contents', report['results'])
+        self.assertEqual(report['results']['render-json']['size_bytes'],
+                         report['results']['render-fast-json']['size_bytes'])
+        # The benchmark data comes with snapshots.
+        self.assertEqual(report['results']['public-menu-detail']['queries'], 1)
+        # The rejected requests are answered without touching the database.
+        self.assertEqual(report['results']['throttle-rejected']['queries'], 0)
+        self.assertEqual(report['results']['throttle-admitted']['size_bytes'],
+                         report['results']['public-menu-detail']['size_bytes'])
+        self.assertFalse(Dish.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+    def test_benchmark_leaves_app_caches_alone(self):
+        for alias in settings.CACHES:
+            caches[alias].set('app-key', 'app-value')
+        call_command('benchmark', menus=2, dishes=4, menu_size=2, users=1, repeat=1,
+                     stdout=StringIO(), stderr=StringIO())
+        for alias in settings.CACHES:
+            self.assertEqual(caches[alias].get('app-key'), 'app-value', alias)
+
+
+class ThrottlingTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+        self.url = reverse('public-menu-detail', kwargs={'pk': 1})
+
+    def __with_rates(self, client_rate, global_rate, **api_settings):
+        return self.settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {'public-client': client_rate, 'public-global': global_rate},
+            **api_settings,
+        })
+
+    def __get_statuses(self, count, address='10.0.0.1', **headers):
+        return [self.client.get(self.url, REMOTE_ADDR=address, **headers).status_code
+                for _ in range(count)]
+
+    def test_client_over_limit_gets_429_with_retry_after(self):
+        with self.__with_rates('3/min', None), mock.patch.object(
+                CounterRateThrottle, 'timer', return_value=600.5):
+            self.assertEqual(self.__get_statuses(4), [200, 200, 200, 429])
+            response = self.client.get(self.url, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_limit_resets_in_next_window(self):
+        with self.__with_rates('2/min', None):
+            with mock.patch.object(CounterRateThrottle, 'timer', return_value=600.0):
+                self.assertEqual(self.__get_statuses(3), [200, 200, 429])
+            with mock.patch.object(CounterRateThrottle, 'timer', return_value=660.0):
+                self.assertEqual(self.__get_statuses(1), [200])
+
+    def test_clients_are_limited_separately(self):
+        with self.__with_rates('2/min', None):
+            self.assertEqual(self.__get_statuses(3, '10.0.0.1'), [200, 200, 429])
+            self.assertEqual(self.__get_statuses(2, '10.0.0.2'), [200, 200])
+
+    def test_forwarded_for_is_trusted_only_behind_proxies(self):
+        with self.__with_rates('2/min', None):
+            statuses = [self.__get_statuses(1, HTTP_X_FORWARDED_FOR=f'192.168.0.{i}')[0]
+                        for i in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+        with self.__with_rates('2/min', None, NUM_PROXIES=1):
+            self.assertEqual(self.__get_statuses(3, HTTP_X_FORWARDED_FOR='192.168.1.1'),
+                             [200, 200, 429])
+            self.assertEqual(self.__get_statuses(2, HTTP_X_FORWARDED_FOR='192.168.1.2'),
+                             [200, 200])
+
+    def test_rejected_requests_do_not_use_up_global_limit(self):
+        with self.__with_rates('2/min', '5/min'):
+            # A scraper, and well-behaved clients which share the rest of the global limit.
+            self.assertEqual(self.__get_statuses(10, '10.0.0.1'), [200, 200] + [429] * 8)
+            self.assertEqual(self.__get_statuses(2, '10.0.0.2'), [200, 200])
+            self.assertEqual(self.__get_statuses(2, '10.0.0.3'), [200, 429])
+
+    def test_throttle_check_does_not_query_database(self):
+        with self.__with_rates('1/min', '100/min'):
+            self.__get_statuses(1)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.__get_statuses(1), [429])
+
+    def test_private_endpoints_are_not_throttled(self):
+        User.objects.create_user(username='Eve', password='abc')
+        self.client.force_authenticate(User.objects.get(username='Eve'))
+        with self.__with_rates('1/min', '1/min'):
+            statuses = [self.client.get(reverse('private-menu-list')).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200] * 3)
+
+
+@override_settings(PUBLIC_MENU_SNAPSHOTS=False)
+class PerformanceTimingTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}))
+        metrics = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(metrics, ['db', 'view', 'render', 'total'])
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    def test_fast_request_is_not_logged(self):
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('emenu.performance'):
+                self.client.get(reverse('public-menu-list'))
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_slow_request_is_logged_with_queries(self):
+        with self.assertLogs('emenu.performance', level='WARNING') as logs:
+            self.client.get(reverse('public-menu-list'))
+        record = logs.records[0].slow_request
+        self.assertEqual(record['path'], reverse('public-menu-list'))
+        self.assertEqual(record['query_count'], 2)
+        self.assertIn('menu_menu', record['slowest_queries'][0]['sql'])
+
+
+class FastSerializationTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def __get_content(self, url, fast):
+        get_cache().clear()
+        with self.settings(PUBLIC_FAST_SERIALIZATION=fast):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content
+
+    def __assert_identical(self, url):
+        self.assertEqual(self.__get_content(url, fast=True),
+                         self.__get_content(url, fast=False))
+
+    def test_menu_list_is_identical(self):
+        self.__assert_identical(reverse('public-menu-list'))
+        self.__assert_identical(reverse('public-menu-list') + '?ordering=-dishes__count,name')
+        self.__assert_identical(reverse('public-menu-list') + '?page_size=2')
+
+    def test_menu_details_are_identical(self):
+        for menu in Menu.objects.all():
+            self.__assert_identical(reverse('public-menu-detail', kwargs={'pk': menu.pk}))
+
+    def test_missing_menu(self):
+        get_cache().clear()
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': 1000}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RendererTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_fast_json_is_identical_to_json(self):
+        menus = PublicMenuDetailSerializer(
+            Menu.objects.all(), many=True, context={'request': None}).data
+        data = {
+            'menus': menus,
+            'values': [Decimal('12.50'), timedelta(minutes=15), timezone.now(),
+                       date(2021, 9, 12), 0.25, None, True, 'Crème brûlée \u2028'],
+            1: {'errors': ['Invalid hyperlink - Object does not exist.']},
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_msgpack_is_chosen_by_accept_header(self):
+        User.objects.create_user(username='Eve', password='abc')
+        self.client.force_authenticate(User.objects.get(username='Eve'))
+        for url in (reverse('public-menu-list'), reverse('public-menu-detail', kwargs={'pk': 3}),
+                    reverse('private-menu-list'), reverse('dish-list')):
+            get_cache().clear()
+            response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            get_cache().clear()
+            json_response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(msgpack.unpackb(response.content),
+                             json.loads(json_response.content))
+
+
+class OpenApiSchemaTests(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.schema_file = os.path.join(directory.name, 'openapi-schema.json')
+        clear_schema()
+        self.addCleanup(clear_schema)
+
+    def __get_live_schema(self, params):
+        view = get_schema_view(**SCHEMA_INFO, public=True)
+        response = view(APIRequestFactory().get('/openapi/', params))
+        return response.render().content
+
+    def test_cached_schema_matches_live_generation(self):
+        for built in (False, True):
+            with self.settings(OPENAPI_SCHEMA_FILE=self.schema_file):
+                if built:
+                    call_command('build_openapi_schema', stdout=StringIO())
+                clear_schema()
+                for params in ({}, {'format': 'openapi-json'}):
+                    response = self.client.get(reverse('openapi-schema'), params)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    self.assertEqual(response.content, self.__get_live_schema(params))
+        self.assertTrue(os.path.exists(self.schema_file))
+
+    def test_operation_ids_are_unique(self):
+        operation_ids = [operation['operationId']
+                         for path in generate_schema()['paths'].values()
+                         for operation in path.values()]
+        self.assertEqual(len(operation_ids), len(set(operation_ids)))
+        self.assertIn('listSearchMenus', operation_ids)
+
+    def test_schema_is_generated_once(self):
+        with self.settings(OPENAPI_SCHEMA_FILE=self.schema_file), \
+                mock.patch('emenu.menu.schema.SchemaGenerator.get_schema',
+                           autospec=True, side_effect=SchemaGenerator.get_schema) as get_schema:
+            for _ in range(3):
+                self.client.get(reverse('openapi-schema'))
+        self.assertEqual(get_schema.call_count, 1)
+
+    def test_schema_is_revalidated(self):
+        with self.settings(OPENAPI_SCHEMA_FILE=self.schema_file):
+            response = self.client.get(reverse('openapi-schema'))
+            self.assertIn('Last-Modified', response)
+            not_modified = self.client.get(reverse('openapi-schema'),
+                                           HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(not_modified.content, b'')
+            json_response = self.client.get(reverse('openapi-schema'), {'format': 'openapi-json'},
+                                            HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(json_response.status_code, status.HTTP_200_OK)
+
+
+class HyperlinkFormattingTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def test_urls_are_identical_to_reverse(self):
+        factory = APIRequestFactory()
+        requests = [
+            None,
+            factory.get('/'),
+            factory.get('/', {'format': 'json'}),
+            factory.get('/', secure=True, HTTP_HOST='testserver:8443'),
+        ]
+        for request in requests:
+            for view_name in ('dish-detail', 'public-menu-detail', 'private-menu-detail'):
+                formatter = get_url_formatter(view_name, request)
+                for pk in (1, 42, 1234567, '17'):
+                    self.assertEqual(formatter(pk),
+                                     drf_reverse(view_name, kwargs={'pk': pk}, request=request))
+
+    @override_settings(PUBLIC_MENU_SNAPSHOTS=False)
+    def test_urls_are_reversed_once_per_request(self):
+        User.objects.create_user(username='Eve', password='abc')
+        self.client.force_authenticate(User.objects.get(username='Eve'))
+        for fast in (True, False):
+            get_cache().clear()
+            with self.settings(PUBLIC_FAST_SERIALIZATION=fast), \
+                    mock.patch('emenu.menu.relations.reverse', wraps=drf_reverse) as reverse_mock:
+                self.client.get(reverse('public-menu-detail', kwargs={'pk': 3}), format='json')
+            # The menu URL and the dish URL, for the 6 dishes of the menu.
+            self.assertEqual(reverse_mock.call_count, 2)
+        with mock.patch('emenu.menu.relations.reverse', wraps=drf_reverse) as reverse_mock:
+            self.client.get(reverse('private-menu-list'), format='json')
+        self.assertEqual(reverse_mock.call_count, 2)
+
+
+class MenuSnapshotTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        get_cache().clear()
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager',
+                        celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+        build_snapshots()
+
+    def __get_content(self, url, snapshots):
+        get_cache().clear()
+        with self.settings(PUBLIC_MENU_SNAPSHOTS=snapshots):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content
+
+    def test_snapshots_are_identical_to_live_serialization(self):
+        urls = [reverse('public-menu-detail', kwargs={'pk': menu.pk})
+                for menu in Menu.objects.all()]
+        urls += [reverse('public-menu-list'),
+                 reverse('public-menu-list') + '?ordering=-dishes__count,name&page_size=2',
+                 reverse('public-menu-list') + '?format=json',
+                 reverse('public-menu-detail', kwargs={'pk': 1}) + '?format=json']
+        for url in urls:
+            self.assertEqual(self.__get_content(url, snapshots=True),
+                             self.__get_content(url, snapshots=False), url)
+
+    def test_snapshot_is_served_with_a_single_query(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}), format='json')
+        get_cache().clear()
+        with self.assertNumQueries(1):
+            self.client.get(reverse('public-menu-list'), format='json')
+
+    def test_snapshot_is_rebuilt_after_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            dish = Dish.objects.get(pk=1)
+            dish.name = 'Curly fries'
+            dish.save()
+        snapshot = MenuSnapshot.objects.get(menu_id=1)
+        self.assertIn(b'Curly fries', bytes(snapshot.detail))
+
+    def test_invalid_menu_id_is_not_found(self):
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': 'abc'}), format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rebuild_does_not_replace_snapshot_of_later_change(self):
+        # A concurrent rebuild, which read the data of a later change, committed first.
+        MenuSnapshot.objects.filter(menu_id=1).update(
+            detail=b'{"later":true}', change_id=get_latest_change_id() + 1)
+        build_snapshots([1, 2])
+        self.assertEqual(bytes(MenuSnapshot.objects.get(menu_id=1).detail), b'{"later":true}')
+        self.assertEqual(MenuSnapshot.objects.get(menu_id=2).change_id, Change.objects.filter(
+            model=Change.MENU, object_id=2).latest('id').id)
+
+    def test_missing_snapshot_falls_back_to_live_serialization(self):
+        MenuSnapshot.objects.filter(menu_id=1).delete()
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': 1}), format='json')
+        self.assertContains(response, 'French fries')
+
+    def test_check_command(self):
+        call_command('check_menu_snapshots', stdout=StringIO())
+        MenuSnapshot.objects.filter(menu_id=1).update(detail=b'{}')
+        with self.assertRaises(CommandError):
+            call_command('check_menu_snapshots', stdout=StringIO())
+        call_command('check_menu_snapshots', rebuild=True, stdout=StringIO())
+        call_command('check_menu_snapshots', stdout=StringIO())
+
+
+class SearchTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def __search(self, url_name, query, **params):
+        response = self.client.get(reverse(url_name), dict(q=query, **params), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    def test_searching_dishes_by_description(self):
+        results = self.__search('public-dish-search-list', 'feta')['results']
+        self.assertEqual([dish['name'] for dish in results], ['Greek salad'])
+
+    def test_name_matches_rank_higher(self):
+        Dish.objects.create(name='Dish of wine', description='Cooked in red.',
+                            price='10.00', preparation_time=timedelta(minutes=5))
+        Dish.objects.create(name='Pasta', description='Served with a glass of wine.',
+                            price='10.00', preparation_time=timedelta(minutes=5))
+        for menu in Menu.objects.filter(dish_count__gt=0):
+            menu.dishes.add(*Dish.objects.filter(name__in=['Dish of wine', 'Pasta']))
+        names = [dish['name'] for dish in
+                 self.__search('public-dish-search-list', 'wine')['results']]
+        self.assertLess(names.index('Dish of wine'), names.index('Pasta'))
+
+    def test_dishes_outside_public_menus_are_not_found(self):
+        Dish.objects.create(name='Secret soup', description='Not served yet.',
+                            price='10.00', preparation_time=timedelta(minutes=5))
+        self.assertEqual(self.__search('public-dish-search-list', 'soup')['results'], [])
+
+    def test_searching_menus_paginates(self):
+        first_page = self.__search('public-menu-search-list', 'menu', page_size=1)
+        names = [menu['name'] for menu in first_page['results']]
+        url = first_page['next']
+        while url is not None:
+            page = json.loads(self.client.get(url, format='json').content)
+            names += [menu['name'] for menu in page['results']]
+            url = page['next']
+        self.assertEqual(len(names), Menu.objects.filter(dish_count__gt=0).count())
+        self.assertEqual(len(set(names)), len(names))
+
+    def test_query_is_required(self):
+        response = self.client.get(reverse('public-menu-search-list'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CHANGE_LOG_SAFETY_LAG=0)
+class ChangeFeedTests(APITestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        self.url = reverse('public-menu-changes-list')
+        self.since = get_latest_change_id()
+
+    def __get_changes(self, since):
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    def test_without_cursor_returns_current_cursor(self):
+        response = self.client.get(self.url)
+        self.assertEqual(json.loads(response.content),
+                         {'cursor': self.since, 'has_more': False, 'results': []})
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_changes_since_cursor(self):
+        french_fries = Dish.objects.get(pk=1)
+        french_fries.price = '7.00'
+        french_fries.save()
+        menu = Menu.objects.create(name='December Menu', description='Winter.')
+        menu.dishes.add(2)
+        Menu.objects.get(pk=4).delete()
+
+        changes = self.__get_changes(self.since)
+        self.assertFalse(changes['has_more'])
+        self.assertEqual(changes['cursor'], get_latest_change_id())
+        # Every menu is listed once, with its last change.
+        self.assertEqual([(change['pk'], change['action']) for change in changes['results']],
+                         [(1, 'updated'), (3, 'updated'), (menu.pk, 'updated'), (4, 'deleted')])
+        self.assertEqual(changes['results'][0]['url'],
+                         drf_reverse('public-menu-detail', kwargs={'pk': 1},
+                                     request=APIRequestFactory().get('/')))
+        self.assertIsNone(changes['results'][3]['url'])
+
+        self.assertEqual(self.__get_changes(changes['cursor'])['results'], [])
+
+    @override_settings(CHANGE_FEED_PAGE_SIZE=2)
+    def test_changes_are_read_in_pages(self):
+        for pk in (1, 2, 3):
+            Menu.objects.get(pk=pk).save()
+
+        first = self.__get_changes(self.since)
+        self.assertTrue(first['has_more'])
+        self.assertEqual([change['pk'] for change in first['results']], [1, 2])
+        second = self.__get_changes(first['cursor'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual([change['pk'] for change in second['results']], [3])
+
+    @override_settings(CHANGE_LOG_SAFETY_LAG=60)
+    def test_cursor_does_not_pass_recent_changes(self):
+        Menu.objects.get(pk=2).save()
+        Menu.objects.get(pk=1).save()
+        # The change of the menu 2 is not committed yet.
+        late_change = Change.objects.get(model=Change.MENU, object_id=2, id__gt=self.since)
+        Change.objects.filter(pk=late_change.pk).delete()
+        changes = self.__get_changes(self.since)
+        self.assertEqual([change['pk'] for change in changes['results']], [1])
+        self.assertEqual((changes['cursor'], changes['has_more']), (self.since, False))
+
+        # The change with the lower id, committed later, is listed in the next request.
+        late_change.save(force_insert=True)
+        changes = self.__get_changes(changes['cursor'])
+        self.assertEqual([change['pk'] for change in changes['results']], [2, 1])
+
+        Change.objects.update(date=timezone.now() - timedelta(minutes=2))
+        changes = self.__get_changes(changes['cursor'])
+        self.assertEqual(changes['cursor'], get_latest_change_id())
+        self.assertEqual(self.__get_changes(changes['cursor'])['results'], [])
+
+    @override_settings(CHANGE_LOG_SAFETY_LAG=60)
+    def test_digest_leaves_recent_changes_to_next_run(self):
+        set_watermark(NEW_DISHES_MAIL_WATERMARK, self.since)
+        Dish.objects.get(pk=1).save()
+        schedule_new_dishes_mail()
+        self.assertEqual(get_watermark(NEW_DISHES_MAIL_WATERMARK), self.since)
+
+    def test_dish_changes_are_not_listed(self):
+        Dish.objects.create(name='Risotto', description='Creamy.', price='21.00',
+                            preparation_time=timedelta(minutes=25))
+        changes, cursor, has_more = get_changes(Change.MENU, self.since, 10)
+        self.assertEqual((changes, cursor, has_more), ([], self.since, False))
+
+
 class PrivateApiTests(APITestCase):
     fixtures = ['testing.json']
 
@@ -98,7 +1050,7 @@ class PrivateApiTests(APITestCase):
         url = reverse('dish-list')
         self.__authenticate()
         response = self.client.get(url, format='json')
-        json_response = json.loads(response.content)
+        json_response = json.loads(response.content)['results']
         self.assertContains(
             response, 'The fresh salad with Greek feta cheese.', status_code=status.HTTP_200_OK)
         self.assertEqual(len(json_response), 6)
@@ -176,22 +1128,478 @@ class PrivateApiTests(APITestCase):
         self.assertGreater(parse_datetime(response_dict['date_modified']), timezone.now() -
                            timedelta(minutes=1))
 
+    def __change_dishes(self, menu_pk, action, dish_ids):
+        url = reverse(f'private-menu-{action}-dishes', kwargs={'pk': menu_pk})
+        return self.client.post(url, format='json', data={'dishes': dish_ids})
+
+    def test_adding_and_removing_menu_dishes(self):
+        self.__authenticate()
+        response = self.__change_dishes(1, 'add', [4, 1, 6])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['dish_count'], 5)
+        self.assertEqual(sorted(Menu.objects.get(pk=1).dishes.values_list('pk', flat=True)),
+                         [1, 2, 3, 4, 6])
+
+        response = self.__change_dishes(1, 'remove', [1, 2])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Menu.objects.get(pk=1).dish_count, 3)
+        self.assertEqual(sorted(Menu.objects.get(pk=1).dishes.values_list('pk', flat=True)),
+                         [3, 4, 6])
+
+    def test_adding_nonexistent_dishes(self):
+        self.__authenticate()
+        response = self.__change_dishes(1, 'add', [4, 1000, 1001])
+        self.assertContains(response, '1000, 1001', status_code=status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Menu.objects.get(pk=1).dish_count, 3)
+
+    def test_changing_menu_dishes_inaccessible_to_public(self):
+        response = self.__change_dishes(1, 'add', [4])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_adding_dishes_does_not_depend_on_menu_size(self):
+        self.__authenticate()
+        create_dishes(f'Dish {i}' for i in range(500))
+        large_menu = Menu.objects.create(name='Large Menu', description='A large menu.')
+        large_menu.dishes.add(*Dish.objects.filter(name__startswith='Dish '))
+
+        query_counts = []
+        for menu_pk in (1, large_menu.pk):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.__change_dishes(menu_pk, 'add', [4])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(Menu.objects.get(pk=large_menu.pk).dish_count, 501)
+
+    def __post_menu(self, name, dish_urls):
+        return self.client.post(reverse('private-menu-list'), format='json', data={
+            'name': name, 'description': 'A menu.', 'dishes': dish_urls})
+
+    def test_menu_dishes_are_resolved_in_one_query(self):
+        self.__authenticate()
+        create_dishes(f'Dish {i}' for i in range(300))
+        dish_urls = ['http://testserver' + reverse('dish-detail', kwargs={'pk': pk})
+                     for pk in Dish.objects.order_by('pk').values_list('pk', flat=True)]
+
+        query_counts = []
+        for name, urls in (('Small Menu', dish_urls[:3]), ('Large Menu', dish_urls)):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.__post_menu(name, urls)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(Menu.objects.get(name='Large Menu').dish_count, 306)
+        self.assertEqual(json.loads(response.content)['dishes'], dish_urls)
+
+    def test_all_invalid_dish_links_are_reported(self):
+        self.__authenticate()
+        response = self.__post_menu('Broken Menu', [
+            reverse('dish-detail', kwargs={'pk': 1}),
+            reverse('dish-detail', kwargs={'pk': 1000}),
+            '/not/a/dish/',
+            reverse('dish-detail', kwargs={'pk': 2}),
+            reverse('private-menu-detail', kwargs={'pk': 1}),
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = json.loads(response.content)['dishes']
+        self.assertEqual(sorted(errors), ['1', '2', '4'])
+        self.assertFalse(Menu.objects.filter(name='Broken Menu').exists())
+
 
 class ReportTests(TestCase):
     fixtures = ['testing.json']
 
+    def setUp(self):
+        self.since = get_latest_change_id()
+
+    def __add_risotto(self):
+        Dish.objects.create(name='Risotto', description='Creamy.', price='21.00',
+                            preparation_time=timedelta(minutes=25))
+
     def test_new_dishes_email_content(self):
-        french_fries = Dish.objects.filter(pk=1).get()
-        yesterday = date.today() - timedelta(days=1)
-        french_fries.date_added = yesterday
-        french_fries.save()
+        self.__add_risotto()
         User.objects.create_user(
             username='Eve', password='abc', email='eve@example.com')
 
-        results = get_new_dishes_mail_contents()
+        results = list(get_new_dishes_mail_contents(self.since, get_latest_change_id()))
 
         self.assertEqual(len(results), 1)
         email_content = results[0][1]
         self.assertGreater(email_content.find('Eve'), -1)
         self.assertGreater(email_content.find('New recipes'), -1)
-        self.assertGreater(email_content.find('French fries'), -1)
+        self.assertGreater(email_content.find('Risotto'), -1)
+
+    def test_modified_dishes_are_listed_apart_from_added(self):
+        self.__add_risotto()
+        french_fries = Dish.objects.get(pk=1)
+        french_fries.price = '7.00'
+        french_fries.save()
+        risotto = Dish.objects.get(name='Risotto')
+        risotto.price = '22.00'
+        risotto.save()
+
+        added, modified = get_dish_changes(self.since, get_latest_change_id())
+        self.assertEqual([dish.name for dish in added], ['Risotto'])
+        self.assertEqual([dish.name for dish in modified], ['French fries'])
+
+    def test_no_email_without_dish_updates(self):
+        User.objects.create_user(
+            username='Eve', password='abc', email='eve@example.com')
+        self.assertEqual(list(get_new_dishes_mail_contents(self.since, get_latest_change_id())), [])
+
+    def test_dish_updates_are_queried_once(self):
+        self.__add_risotto()
+        until = get_latest_change_id()
+        for i in range(20):
+            User.objects.create_user(
+                username=f'User {i}', password='abc', email=f'user{i}@example.com')
+
+        # Two dish queries and one for the users, regardless of their number.
+        with self.assertNumQueries(3):
+            results = list(get_new_dishes_mail_contents(self.since, until))
+        self.assertEqual(len(results), 20)
+        self.assertIn('<h2>New recipes</h2>', results[0][1])
+        self.assertEqual(len({content.replace(f'User {i}', '') for i, (_, content)
+                              in enumerate(results)}), 1)
+
+
+@override_settings(NEW_DISHES_MAIL_CHUNK_SIZE=3, CHANGE_LOG_SAFETY_LAG=0)
+class NewDishesMailTests(TestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager',
+                        celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+
+        # The fixture dishes were mailed about by a previous run.
+        schedule_new_dishes_mail()
+        french_fries = Dish.objects.get(pk=1)
+        french_fries.price = '7.00'
+        french_fries.save()
+        for i in range(10):
+            User.objects.create_user(
+                username=f'User {i}', password='abc', email=f'user{i}@example.com')
+
+    def test_all_users_receive_mail(self):
+        schedule_new_dishes_mail()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         sorted(f'user{i}@example.com' for i in range(10)))
+        # The list of dishes, rendered by the scheduling task, is not escaped again.
+        self.assertIn('<li>French fries</li>', mail.outbox[0].body)
+
+    def test_mails_are_split_into_chunks(self):
+        with mock.patch.object(send_new_dishes_mail_chunk, 'run') as run:
+            schedule_new_dishes_mail()
+        self.assertEqual([len(call.args[1]) for call in run.call_args_list],
+                         [3, 3, 3, 1])
+        # Every chunk gets the list of updated dishes once, and renders the mails itself.
+        self.assertIn('French fries', run.call_args_list[0].args[0])
+        self.assertEqual(run.call_args_list[0].args[1][:2],
+                         [['user0@example.com', 'User 0'], ['user1@example.com', 'User 1']])
+
+    def test_next_run_sends_only_new_updates(self):
+        schedule_new_dishes_mail()
+        self.assertEqual(get_watermark(NEW_DISHES_MAIL_WATERMARK), get_latest_change_id())
+        self.assertIn('French fries', mail.outbox[0].body)
+        mail.outbox.clear()
+
+        schedule_new_dishes_mail()
+        self.assertEqual(mail.outbox, [])
+
+        Dish.objects.filter(pk=2).get().save()
+        schedule_new_dishes_mail()
+        self.assertEqual(len(mail.outbox), 10)
+        self.assertIn('Greek salad', mail.outbox[0].body)
+        self.assertNotIn('French fries', mail.outbox[0].body)
+
+    def test_failed_chunk_retries_only_unsent_mails(self):
+        recipients = [(f'user{i}@example.com', f'User {i}') for i in range(3)]
+        original_send_messages = LocMemEmailBackend.send_messages
+        calls = []
+
+        def send_messages(connection, messages):
+            calls.append(messages[0].to[0])
+            if len(calls) == 2:
+                raise SMTPException('Connection lost')
+            return original_send_messages(connection, messages)
+
+        with mock.patch.object(LocMemEmailBackend, 'send_messages', send_messages):
+            send_new_dishes_mail_chunk.apply(args=['<p>Updates</p>', recipients])
+        self.assertEqual(calls, ['user0@example.com', 'user1@example.com',
+                                 'user1@example.com', 'user2@example.com'])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('User 2', mail.outbox[2].body)
+
+
+class IndexUsageTests(TestCase):
+    """
+    Check that the date range queries are planned with the date indexes on a large table.
+    """
+    ROWS = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        start = timezone.now() - timedelta(days=cls.ROWS)
+        create_dishes(f'Dish {i}' for i in range(cls.ROWS))
+        Menu.objects.bulk_create([
+            Menu(name=f'Menu {i}', description='A menu.') for i in range(cls.ROWS)
+        ])
+        # auto_now fields ignore the assigned dates on save, bulk_update does not.
+        for model in (Dish, Menu):
+            objects = list(model.objects.order_by('pk'))
+            for i, obj in enumerate(objects):
+                obj.date_added = start + timedelta(days=i)
+                obj.date_modified = start + timedelta(days=i, hours=1)
+            model.objects.bulk_update(
+                objects, ['date_added', 'date_modified'], batch_size=500)
+        Menu.objects.update(dish_count=1)
+        for model in (Change.DISH, Change.MENU):
+            log_changes(model, Change.CREATED, range(1, cls.ROWS + 1))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def __assert_uses_index(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_menu_date_added_filter_uses_index(self):
+        since = timezone.now() - timedelta(days=3)
+        queryset = MenuFilter({'date_added__gte': since.isoformat()},
+                              queryset=Menu.objects.filter(dish_count__gt=0)).qs
+        self.__assert_uses_index(queryset, 'menu_menu_date_added_idx')
+
+    def test_menu_date_modified_filter_uses_index(self):
+        since = timezone.now() - timedelta(days=3)
+        queryset = MenuFilter({'date_modified__lt': since.isoformat(),
+                               'date_modified__gt': (since - timedelta(days=3)).isoformat()},
+                              queryset=Menu.objects.filter(dish_count__gt=0)).qs
+        self.__assert_uses_index(queryset, 'menu_menu_date_modified_idx')
+
+    def test_dish_changes_use_change_log_index(self):
+        latest = get_latest_change_id()
+        added, modified = get_dish_changes(latest - 10, latest)
+        self.__assert_uses_index(added, 'menu_change_model_id_idx')
+        self.__assert_uses_index(modified, 'menu_change_model_id_idx')
+
+    def test_menu_changes_use_change_log_index(self):
+        queryset = Change.objects.filter(model=Change.MENU, id__gt=get_latest_change_id() - 10)
+        self.__assert_uses_index(queryset.order_by('id'), 'menu_change_model_id_idx')
+
+
+# The admin pages link the static files, which are not collected for the tests.
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AdminTests(TestCase):
+    fixtures = ['testing.json']
+
+    def setUp(self):
+        User.objects.create_superuser(username='admin', password='abc', email='admin@example.com')
+        self.assertTrue(self.client.login(username='admin', password='abc'))
+
+    def __create_dishes(self, start, count):
+        create_dishes(f'Catalog dish {i}' for i in range(start, start + count))
+
+    def __count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_menu_form_lists_only_selected_dishes(self):
+        self.__create_dishes(0, 50)
+        response = self.client.get(reverse('admin:menu_menu_change', args=[1]))
+        self.assertContains(response, 'French fries')
+        self.assertContains(response, reverse('admin:autocomplete'))
+        self.assertNotContains(response, 'Catalog dish')
+
+    def test_menu_form_query_count_does_not_grow_with_catalog(self):
+        url = reverse('admin:menu_menu_change', args=[1])
+        self.__create_dishes(0, 50)
+        queries = self.__count_queries(url)
+        self.__create_dishes(50, 500)
+        self.assertEqual(self.__count_queries(url), queries)
+
+    def test_dish_autocomplete(self):
+        self.__create_dishes(0, 50)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'term': 'fri', 'app_label': 'menu', 'model_name': 'menu', 'field_name': 'dishes'})
+        self.assertEqual([result['text'] for result in json.loads(response.content)['results']],
+                         ['French fries'])
+
+    def test_dish_changelist_counts_menus_in_one_query(self):
+        url = reverse('admin:menu_dish_changelist')
+        queries = self.__count_queries(url)
+        self.__create_dishes(0, 300)
+        Menu.dishes.through.objects.bulk_create([
+            Menu.dishes.through(menu_id=menu_id, dish_id=dish_id)
+            for menu_id in (1, 2)
+            for dish_id in Dish.objects.filter(name__startswith='Catalog').values_list('pk', flat=True)
+        ])
+        self.assertEqual(self.__count_queries(url), queries)
+
+        response = self.client.get(url, {'q': 'french'})
+        self.assertEqual([(dish.name, dish.menu_count) for dish in response.context['cl'].result_list],
+                         [('French fries', 2)])
+
+    def test_menu_changelist_search(self):
+        response = self.client.get(reverse('admin:menu_menu_changelist'), {'q': 'octob'})
+        self.assertEqual([menu.name for menu in response.context['cl'].result_list], ['October Menu'])
+
+    def test_full_counts_can_be_disabled(self):
+        url = reverse('admin:menu_dish_changelist') + '?q=fries'
+        full_count_queries = self.__count_queries(url)
+        with self.settings(ADMIN_FULL_COUNTS=False):
+            self.assertEqual(self.__count_queries(url), full_count_queries - 1)
+            response = self.client.get(url)
+        self.assertIsNone(response.context['cl'].full_result_count)
+
+
+@skipUnless('replica' in settings.DATABASES, "The replica database is set in emenu.test_settings.")
+@override_settings(DATABASE_REPLICAS=['replica'], PUBLIC_MENU_SNAPSHOTS=False)
+class ReadReplicaTests(APITestCase):
+    """
+    The replica is a second database, with other menus than the primary.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        get_cache().clear()
+        self.__create_menu('default', 'Primary Menu')
+        self.__create_menu('replica', 'Replica Menu')
+        User.objects.create_user(username='Eve', password='abc')
+
+    def __create_menu(self, using, name):
+        # Bulk inserts send no signals, which would write to the primary.
+        create_dishes([f'{name} dish'], using=using)
+        Menu.objects.using(using).bulk_create([Menu(name=name, description='A menu.', dish_count=1)])
+        Menu.dishes.through.objects.using(using).bulk_create([Menu.dishes.through(
+            menu=Menu.objects.using(using).get(name=name),
+            dish=Dish.objects.using(using).get(name=f'{name} dish'))])
+
+    def __get_menu_names(self, url_name, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [menu['name'] for menu in json.loads(response.content)['results']]
+
+    def test_public_reads_go_to_replica(self):
+        self.assertEqual(self.__get_menu_names('public-menu-search-list', q='menu'), ['Replica Menu'])
+        response = self.client.get(reverse('public-dish-search-list'), {'q': 'dish'})
+        self.assertEqual([dish['name'] for dish in json.loads(response.content)['results']],
+                         ['Replica Menu dish'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_cache_is_filled_from_primary(self):
+        self.assertEqual(self.__get_menu_names('public-menu-list'), ['Primary Menu'])
+        pk = Menu.objects.get().pk
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': pk}))
+        self.assertEqual(json.loads(response.content)['dishes'][0]['name'], 'Primary Menu dish')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    @override_settings(PUBLIC_MENU_SNAPSHOTS=True)
+    def test_snapshots_are_read_from_replica(self):
+        menu = Menu.objects.using('replica').get()
+        MenuSnapshot.objects.using('replica').create(
+            menu=menu, detail=b'{"name":"Replica snapshot","dishes":[]}',
+            list_item=b'{"name":"Replica snapshot"}')
+        self.assertEqual(self.__get_menu_names('public-menu-list'), ['Replica snapshot'])
+        response = self.client.get(reverse('public-menu-detail', kwargs={'pk': menu.pk}))
+        self.assertEqual(json.loads(response.content), {'name': 'Replica snapshot', 'dishes': []})
+
+    def test_private_reads_go_to_primary(self):
+        self.client.force_authenticate(User.objects.get(username='Eve'))
+        self.assertEqual(self.__get_menu_names('private-menu-list'), ['Primary Menu'])
+
+    def test_write_pins_client_to_primary(self):
+        self.client.force_authenticate(User.objects.get(username='Eve'))
+        response = self.client.post(reverse('private-menu-list'), {
+            'name': 'New Menu', 'description': 'A menu.', 'dishes': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        self.assertEqual(self.__get_menu_names('public-menu-search-list', q='menu'), ['Primary Menu'])
+
+        # The cookie expires after the pin time.
+        del self.client.cookies[PIN_COOKIE]
+        self.assertEqual(self.__get_menu_names('public-menu-search-list', q='menu'), ['Replica Menu'])
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_public_reads_go_to_primary(self):
+        response = self.client.get(reverse('public-menu-list'))
+        self.assertEqual([menu['name'] for menu in json.loads(response.content)['results']],
+                         ['Primary Menu'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_benchmark_reads_primary(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            call_command('benchmark', menus=2, dishes=4, menu_size=2, users=1, repeat=1,
+                         stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(len(replica_queries), 0)
+
+
+class PooledSQLiteDatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+    pass
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(close_pools)
+
+    def __make_connection(self, **pool):
+        settings_dict = {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(self.directory.name, 'pool.sqlite3'),
+            'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '', 'OPTIONS': {},
+            'TIME_ZONE': None, 'CONN_MAX_AGE': 0, 'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False,
+            'TEST': {}, 'POOL': pool,
+        }
+        pooled = PooledSQLiteDatabaseWrapper(settings_dict, alias='pooled')
+        self.addCleanup(pooled.close)
+        return pooled
+
+    def __connect(self, pooled):
+        with pooled.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return pooled.connection
+
+    def test_connection_is_reused_across_requests(self):
+        pooled = self.__make_connection()
+        raw_connection = self.__connect(pooled)
+        # The handler of request_finished closes the connections, which returns them to the pool.
+        with mock.patch.object(connections, 'all', return_value=[pooled]):
+            request_finished.send(sender=self.__class__)
+        self.assertIsNone(pooled.connection)
+        self.assertIs(self.__connect(pooled), raw_connection)
+
+    def test_connection_is_reused_across_tasks(self):
+        pooled = self.__make_connection()
+        fixup = DjangoWorkerFixup(celery_app)
+        task = send_new_dishes_mail_chunk
+        with mock.patch.object(connections, 'all', return_value=[pooled]):
+            fixup.on_task_prerun(sender=task)
+            raw_connection = self.__connect(pooled)
+            fixup.on_task_postrun(sender=task)
+            self.assertIsNone(pooled.connection)
+            fixup.on_task_prerun(sender=task)
+            self.assertIs(self.__connect(pooled), raw_connection)
+
+    def test_broken_connection_is_replaced_on_checkout(self):
+        pooled = self.__make_connection()
+        raw_connection = self.__connect(pooled)
+        pooled.close()
+        raw_connection.close()
+        self.assertIsNot(self.__connect(pooled), raw_connection)
+
+    def test_idle_connection_expires(self):
+        pooled = self.__make_connection(IDLE_TIMEOUT=0)
+        raw_connection = self.__connect(pooled)
+        pooled.close()
+        self.assertIsNot(self.__connect(pooled), raw_connection)
+
+    def test_pool_size_is_limited(self):
+        first = self.__make_connection(MAX_SIZE=1, TIMEOUT=0)
+        second = self.__make_connection(MAX_SIZE=1, TIMEOUT=0)
+        raw_connection = self.__connect(first)
+        with self.assertRaises(OperationalError):
+            self.__connect(second)
+        first.close()
+        self.assertIs(self.__connect(second), raw_connection)
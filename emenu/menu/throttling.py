@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+import math
+
+
+class CounterRateThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle which counts the requests of fixed time windows in a cache counter,
+    instead of storing the time of every request, so that a check costs one cache operation
+    (two in the first request of a window). The counters are kept in THROTTLE_CACHE_ALIAS,
+    which has to be shared by the worker processes, e.g. memcached, to limit all of them.
+    """
+
+    def get_rate(self):
+        # Read at every request, so that the rates follow the settings.
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        window = int(self.timer() // self.duration)
+        self.window_end = (window + 1) * self.duration
+        key = f'{key}:{window}'
+        cache = caches[settings.THROTTLE_CACHE_ALIAS]
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # The first request of the window, unless another worker has just counted it.
+            if cache.add(key, 1, self.duration + 1):
+                count = 1
+            else:
+                count = cache.incr(key)
+        return count <= self.num_requests
+
+    def wait(self):
+        return max(math.ceil(self.window_end - self.timer()), 1)
+
+
+class PublicClientRateThrottle(CounterRateThrottle):
+    """
+    Limit the requests of every user, or of every IP address for anonymous clients.
+    """
+    scope = 'public-client'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user-{request.user.pk}'
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class PublicGlobalRateThrottle(CounterRateThrottle):
+    """
+    Limit the requests of all clients together.
+    """
+    scope = 'public-global'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': 'all'}
+
+
+class PublicRateThrottle(BaseThrottle):
+    """
+    Apply the per-client limit first, and count in the global limit only the requests
+    which pass it, so that a client over its limit does not use up the global one.
+    """
+    throttle_classes = [PublicClientRateThrottle, PublicGlobalRateThrottle]
+
+    def allow_request(self, request, view):
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, view):
+                self.wait_time = throttle.wait()
+                return False
+        return True
+
+    def wait(self):
+        return self.wait_time
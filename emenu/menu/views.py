@@ -1,24 +1,159 @@
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
-from emenu.menu.filters import MenuFilter
-from emenu.menu.models import Dish, Menu
-from emenu.menu.serializers import DishSerializer, PrivateMenuSerializer, PublicMenuSimpleSerializer, PublicMenuDetailSerializer
-from rest_framework import permissions, viewsets, filters, mixins
-from rest_framework.decorators import api_view, schema
+from emenu.menu.bulk import upsert_dishes
+from emenu.menu.cache import CachedListMixin, CachedRetrieveMixin
+from emenu.menu.changes import get_changes, get_settled_change_id
+from emenu.menu.export import EXPORT_FORMATS, iter_catalog
+from emenu.menu.fast_serializers import FastPublicMenuSerializer
+from emenu.menu.filters import AliasedOrderingFilter, MenuDishFilter, MenuFilter
+from emenu.menu.models import Change, Dish, Menu, MenuSnapshot
+from emenu.menu.parsers import NDJSONParser
+from emenu.menu.schema import get_schema
+from emenu.menu.search import search
+from emenu.menu.snapshots import can_serve_snapshot, get_snapshot_response, render_json
+from emenu.menu.serializers import DishImportSerializer, DishSerializer, MenuChangeSerializer, MenuDishesSerializer, PrivateMenuSerializer, PublicMenuSimpleSerializer, PublicMenuDetailSerializer
+from emenu.menu.throttling import PublicRateThrottle
+from rest_framework import permissions, viewsets, mixins
+from rest_framework.decorators import action, api_view, permission_classes, schema
 from rest_framework.exceptions import ParseError
+from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.reverse import reverse
+from rest_framework.schemas.openapi import AutoSchema
+from rest_framework.schemas.views import SchemaView
+from types import GeneratorType
 import re
 
 
-class PublicMenuViewSet(viewsets.GenericViewSet,
-                        mixins.ListModelMixin):
+class DishFilteredMenuMixin:
+    """
+    Prefetch only the dishes of the menus which match the dish filters of the view's
+    filterset (see MenuDishFilter), so that the nested dishes are filtered in the same query.
+    """
+    dish_queryset = Dish.objects.order_by('pk')
+
+    def get_dish_conditions(self):
+        if self.request is None:
+            # The schema is generated without a request.
+            return {}
+        if not hasattr(self, '_dish_conditions'):
+            filterset = DjangoFilterBackend().get_filterset(
+                self.request, Menu.objects.none(), self)
+            if filterset is not None and filterset.is_valid():
+                self._dish_conditions = filterset.get_dish_conditions()
+            else:
+                # An invalid filterset is reported by filter_queryset().
+                self._dish_conditions = {}
+        return self._dish_conditions
+
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related(Prefetch(
+            'dishes', queryset=self.dish_queryset.filter(**self.get_dish_conditions())))
+
+
+class FastPublicMenuListMixin(DishFilteredMenuMixin, mixins.ListModelMixin):
+    """
+    List menus through FastPublicMenuSerializer, unless PUBLIC_FAST_SERIALIZATION is off.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not settings.PUBLIC_FAST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+
+        serializer = FastPublicMenuSerializer(
+            request, format=self.format_kwarg, dish_conditions=self.get_dish_conditions())
+        queryset = serializer.get_menu_values(
+            self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(list(queryset)))
+
+
+class FastPublicMenuRetrieveMixin(DishFilteredMenuMixin, mixins.RetrieveModelMixin):
+    """
+    Retrieve a menu through FastPublicMenuSerializer, unless PUBLIC_FAST_SERIALIZATION is off.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.PUBLIC_FAST_SERIALIZATION:
+            return super().retrieve(request, *args, **kwargs)
+
+        serializer = FastPublicMenuSerializer(
+            request, detail=True, format=self.format_kwarg,
+            dish_conditions=self.get_dish_conditions())
+        queryset = self.filter_queryset(self.get_queryset())
+        row = get_object_or_404(serializer.get_menu_values(queryset),
+                                pk=kwargs[self.lookup_field])
+        return Response(serializer.to_representation([row])[0])
+
+
+class SnapshotPublicMenuListMixin(DishFilteredMenuMixin):
+    """
+    List menus by joining their stored snapshots, when all menus of the page have one.
+    Snapshots hold all dishes of a menu, so they are skipped when the dishes are filtered.
+    They are not cached, so they are read before the response cache, and from the replicas.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if (not settings.PUBLIC_MENU_SNAPSHOTS or not can_serve_snapshot(request)
+                or self.get_dish_conditions()):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None).values(
+            'pk', 'dish_count', 'name', 'snapshot__list_item')
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        if any(row['snapshot__list_item'] is None for row in rows):
+            return super().list(request, *args, **kwargs)
+
+        results = b'[' + b','.join(bytes(row['snapshot__list_item']) for row in rows) + b']'
+        if page is None:
+            return get_snapshot_response(results, request)
+        envelope = render_json(self.get_paginated_response([]).data)
+        # The envelope ends with the empty results list: '[]}'.
+        return get_snapshot_response(envelope[:-3] + results + b'}', request)
+
+
+class SnapshotPublicMenuRetrieveMixin(DishFilteredMenuMixin):
+    """
+    Retrieve a menu as its stored snapshot, without touching the menu and dish tables.
+    Snapshots hold all dishes of a menu, so they are skipped when the dishes are filtered.
+    They are not cached, so they are read before the response cache, and from the replicas.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        if (settings.PUBLIC_MENU_SNAPSHOTS and can_serve_snapshot(request)
+                and not self.get_dish_conditions()):
+            try:
+                menu_pk = Menu._meta.pk.to_python(kwargs[self.lookup_field])
+            except ValidationError:
+                raise Http404
+            snapshot = MenuSnapshot.objects.filter(
+                menu_id=menu_pk).values_list('detail', flat=True).first()
+            if snapshot is not None:
+                return get_snapshot_response(snapshot, request)
+        return super().retrieve(request, *args, **kwargs)
+
+
+class PublicMenuViewSet(SnapshotPublicMenuListMixin,
+                        CachedListMixin,
+                        FastPublicMenuListMixin,
+                        viewsets.GenericViewSet):
     """
     Get the list of all menus. This is a public method.
 
     The optional 'ordering' parameter accepts ordering by two fields:
-    - dishes__count
+    - dishes__count (or its alias, dish_count)
     - name
 
     By default, the results are sorted in ascending order. To sort in descending order, add '-' prefix. For example,
@@ -29,24 +164,126 @@ class PublicMenuViewSet(viewsets.GenericViewSet,
 
     <pre>?date_added__lt=2021-01-01</pre>
 
-    will show only the menus added before year 2021.
+    will show only the menus added before year 2021. The dish filters select the menus
+    with at least one dish matching all of them, and list only the matching dishes. For example,
+
+    <pre>?is_vegan=true&price__lte=30&preparation_time__lte=00:15:00</pre>
+
+    will show the menus with a vegan dish under 30 PLN, which is ready in 15 minutes.
+
+    The results are paginated. Follow the 'next' and 'previous' links of the response
+    to move between pages, and use the optional 'page_size' parameter to change the page size.
     """
-    queryset = Menu.objects.annotate(Count('dishes')).exclude(dishes__count=0)
+    queryset = Menu.objects.filter(dish_count__gt=0)
+    dish_queryset = Dish.objects.only('name').order_by('pk')
     serializer_class = PublicMenuSimpleSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [filters.OrderingFilter, DjangoFilterBackend]
+    throttle_classes = [PublicRateThrottle]
+    read_from_replicas = True
+    filter_backends = [AliasedOrderingFilter, DjangoFilterBackend]
     filterset_class = MenuFilter
-    ordering_fields = ['name', 'dishes__count']
+    ordering_fields = ['name', 'dishes__count', 'dish_count']
+    ordering_aliases = {'dishes__count': 'dish_count'}
+    # The operationIds differ from the ones of the private menus.
+    schema = AutoSchema(operation_id_base='PublicMenu')
 
 
-class PublicMenuDetailsViewSet(viewsets.GenericViewSet,
-                               mixins.RetrieveModelMixin):
+class PublicMenuDetailsViewSet(SnapshotPublicMenuRetrieveMixin,
+                               CachedRetrieveMixin,
+                               FastPublicMenuRetrieveMixin,
+                               viewsets.GenericViewSet):
     """
     Get the details of a single menu, including details of dishes. This is a public method.
+
+    The optional dish filters (is_vegan, price__gte, price__lte, preparation_time__gte,
+    preparation_time__lte) list only the matching dishes. The menu is not found
+    when none of its dishes matches them.
     """
     queryset = Menu.objects.all()
     serializer_class = PublicMenuDetailSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [PublicRateThrottle]
+    read_from_replicas = True
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = MenuDishFilter
+    schema = AutoSchema(operation_id_base='PublicMenu')
+
+
+class SearchMixin:
+    """
+    Filter the queryset by the required 'q' parameter and order it by relevance.
+    """
+    ordering = ['-rank']
+
+    def get_queryset(self):
+        text = self.request.query_params.get('q', '').strip()
+        if not text:
+            raise ParseError("The 'q' parameter is required.")
+        return search(super().get_queryset(), text)
+
+
+class PublicMenuSearchViewSet(SearchMixin,
+                              viewsets.GenericViewSet,
+                              mixins.ListModelMixin):
+    """
+    Search menus by name and description. This is a public method.
+
+    The 'q' parameter holds the searched words. The results are sorted by relevance and paginated.
+    """
+    queryset = Menu.objects.filter(dish_count__gt=0).prefetch_related(
+        Prefetch('dishes', queryset=Dish.objects.only('name').order_by('pk')))
+    serializer_class = PublicMenuSimpleSerializer
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = [PublicRateThrottle]
+    read_from_replicas = True
+    schema = AutoSchema(operation_id_base='SearchMenu')
+
+
+class PublicDishSearchViewSet(SearchMixin,
+                              viewsets.GenericViewSet,
+                              mixins.ListModelMixin):
+    """
+    Search the dishes of public menus by name and description. This is a public method.
+
+    The 'q' parameter holds the searched words. The results are sorted by relevance and paginated.
+    """
+    queryset = Dish.objects.filter(Exists(Menu.dishes.through.objects.filter(
+        dish_id=OuterRef('pk'), menu__dish_count__gt=0)))
+    serializer_class = DishSerializer
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = [PublicRateThrottle]
+    read_from_replicas = True
+    schema = AutoSchema(operation_id_base='SearchDish')
+
+
+class PublicMenuChangesViewSet(viewsets.GenericViewSet):
+    """
+    Get the menus created, updated or deleted since the 'since' cursor. This is a public method.
+
+    A menu is updated also when its dishes, or their contents, change. Every menu is listed
+    once, with its last change. Request the next changes with the returned 'cursor',
+    until 'has_more' is false. Without 'since', only the current cursor is returned.
+    """
+    serializer_class = MenuChangeSerializer
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = [PublicRateThrottle]
+    pagination_class = None
+
+    def list(self, request):
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'cursor': get_settled_change_id(), 'has_more': False, 'results': []})
+        try:
+            since = int(since)
+        except ValueError:
+            raise ParseError("The 'since' parameter has to be an integer cursor.")
+        changes, cursor, has_more = get_changes(
+            Change.MENU, since, settings.CHANGE_FEED_PAGE_SIZE)
+        return Response({
+            'cursor': cursor,
+            'has_more': has_more,
+            'results': self.get_serializer(changes, many=True).data,
+        })
 
 
 class PrivateMenuViewSet(viewsets.ModelViewSet):
@@ -68,11 +305,51 @@ class PrivateMenuViewSet(viewsets.ModelViewSet):
 
     destroy:
     Delete a menu. This method requires the user to be logged in.
+
+    add_dishes:
+    Add dishes to a menu, given a list of dish ids. Dishes already in the menu are skipped.
+    This method requires the user to be logged in.
+
+    remove_dishes:
+    Remove dishes from a menu, given a list of dish ids. This method requires the user to be logged in.
     """
-    queryset = Menu.objects.all()
+    queryset = Menu.objects.prefetch_related(
+        Prefetch('dishes', queryset=Dish.objects.only('pk')))
     serializer_class = PrivateMenuSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        if self.action in ('add_dishes', 'remove_dishes'):
+            # Only the changed dishes are touched, so the current ones are not loaded.
+            return Menu.objects.all()
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.action in ('add_dishes', 'remove_dishes'):
+            return MenuDishesSerializer
+        return super().get_serializer_class()
+
+    @action(detail=True, methods=['post'], url_path='dishes/add')
+    def add_dishes(self, request, pk=None):
+        return self._change_dishes(request, lambda menu, dish_ids: menu.dishes.add(*dish_ids))
+
+    @action(detail=True, methods=['post'], url_path='dishes/remove')
+    def remove_dishes(self, request, pk=None):
+        return self._change_dishes(request, lambda menu, dish_ids: menu.dishes.remove(*dish_ids))
+
+    def _change_dishes(self, request, change):
+        """
+        Apply the change to the through table only. The m2m_changed handlers
+        update the dish count of the menu and invalidate its public documents.
+        """
+        menu = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            Menu.objects.filter(pk=menu.pk).update(date_modified=timezone.now())
+            change(menu, serializer.validated_data['dishes'])
+        return Response({'pk': menu.pk, 'dish_count': menu.dish_count})
+
 
 class PrivateDishViewSet(viewsets.ModelViewSet):
     """
@@ -93,11 +370,73 @@ class PrivateDishViewSet(viewsets.ModelViewSet):
 
     destroy:
     Delete a dish. This method requires the user to be logged in.
+
+    bulk:
+    Create or update many dishes at once, matching them by name. The body is a JSON array
+    or an NDJSON stream (Content-Type: application/x-ndjson) of dishes. Invalid rows are skipped
+    and reported in 'errors' with their zero-based row number. Dishes equal to their rows are left
+    unchanged and only counted. This method requires the user to be logged in.
     """
     queryset = Dish.objects.all()
     serializer_class = DishSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_serializer_class(self):
+        if self.action == 'bulk':
+            return DishImportSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        rows = request.data
+        if not isinstance(rows, (list, GeneratorType)):
+            raise ParseError('Expected a list of dishes.')
+        return Response(upsert_dishes(rows))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_catalog(request):
+    """
+    Stream all menus with their dishes. This method requires the user to be logged in.
+
+    The optional 'export_format' parameter selects the output format:
+    - ndjson (default): one JSON object per menu, with the dishes nested
+    - csv: one row per menu and dish pair
+    """
+    export_format = request.query_params.get('export_format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        raise ParseError(
+            f"Unknown export format '{export_format}', choose one of: {', '.join(EXPORT_FORMATS)}.")
+    response = StreamingHttpResponse(iter_catalog(export_format, {'request': request}),
+                                     content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="catalog.{export_format}"'
+    return response
+
+
+class CachedSchemaView(SchemaView):
+    """
+    Serve the OpenAPI schema of get_schema(), rendered once per format, with ETag and
+    Last-Modified headers, so that the docs page can revalidate it with 304 Not Modified.
+    """
+    public = True
+
+    def get(self, request, *args, **kwargs):
+        cached_schema = get_schema()
+        renderer = request.accepted_renderer
+        if isinstance(renderer, BrowsableAPIRenderer):
+            return Response(cached_schema.data)
+
+        content, etag = cached_schema.render(renderer)
+        content_type = renderer.media_type
+        if renderer.charset is not None:
+            content_type += f'; charset={renderer.charset}'
+        response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(cached_schema.last_modified)
+        return get_conditional_response(request, etag=etag, last_modified=cached_schema.last_modified,
+                                        response=response)
+
 
 @api_view(['GET'])
 @schema(None)
@@ -113,5 +452,7 @@ def api_root(request, format=None):
         'docs': reverse('swagger-ui', request=request, format=format),
         'private-dishes': reverse('dish-list', request=request, format=format),
         'private-menus': reverse('private-menu-list', request=request, format=format),
+        'private-export': reverse('catalog-export', request=request, format=format),
         'public-menus': reverse('public-menu-list', request=request, format=format),
+        'public-menu-changes': reverse('public-menu-changes-list', request=request, format=format),
     })
@@ -16,6 +16,8 @@ from pathlib import Path
 import os
 from celery.schedules import crontab
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
+from importlib.util import find_spec
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -57,6 +59,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'emenu.menu.middleware.PerformanceTimingMiddleware',
+    # Before the session middleware, so that saving a session pins the client to the primary.
+    'emenu.db.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -67,6 +72,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Requests slower than this are logged with their slowest queries by PerformanceTimingMiddleware.
+SLOW_REQUEST_THRESHOLD_MS = int(
+    os.environ.get('SLOW_REQUEST_THRESHOLD_MS', default=500))
+SLOW_REQUEST_LOGGED_QUERIES = 10
+
 ROOT_URLCONF = 'emenu.urls'
 
 TEMPLATES = [
@@ -102,10 +112,88 @@ DATABASES = {
 }
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
-db_from_env = dj_database_url.config(
-    default=DATABASE_URL, conn_max_age=500, ssl_require=True)
+db_from_env = dj_database_url.config(default=DATABASE_URL, ssl_require=True)
 DATABASES['default'].update(db_from_env)
 
+# Database connections of the gunicorn and Celery workers:
+# - none: a new connection for every request and task
+# - persistent: one connection per worker thread, reopened after DB_POOL_IDLE_TIMEOUT seconds
+# - pool: a pool of up to DB_POOL_MAX_SIZE connections per worker process, checked with
+#   a query on checkout and closed after DB_POOL_IDLE_TIMEOUT idle seconds (PostgreSQL only)
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', default='persistent')
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', default=10))
+DB_POOL_IDLE_TIMEOUT = int(os.environ.get('DB_POOL_IDLE_TIMEOUT', default=500))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', default=30))
+
+if DB_POOL_MODE == 'none':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+elif DB_POOL_MODE == 'persistent':
+    DATABASES['default']['CONN_MAX_AGE'] = DB_POOL_IDLE_TIMEOUT
+elif DB_POOL_MODE == 'pool':
+    DATABASES['default'].update({
+        'ENGINE': 'emenu.db.postgresql',
+        # Every request and task returns its connection to the pool.
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': DB_POOL_MAX_SIZE,
+            'IDLE_TIMEOUT': DB_POOL_IDLE_TIMEOUT,
+            'TIMEOUT': DB_POOL_TIMEOUT,
+        },
+    })
+else:
+    raise ImproperlyConfigured(
+        f"Unknown DB_POOL_MODE '{DB_POOL_MODE}', choose one of: none, persistent, pool.")
+
+# Read replicas of the primary database, as comma-separated database URLs. The safe
+# requests to the public menu endpoints read them, see emenu.db.routers. A client which
+# wrote something reads the primary for the next REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+for i, replica_url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', default='').split(','))):
+    alias = f'replica{i + 1}'
+    replica = dict(DATABASES['default'])
+    # The engine and connection handling of the primary are kept.
+    replica.update({key: value for key, value in dj_database_url.parse(replica_url, ssl_require=True).items()
+                    if key not in ('ENGINE', 'CONN_MAX_AGE')})
+    # The tests see the data of the primary through the replicas.
+    replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES[alias] = replica
+    DATABASE_REPLICAS.append(alias)
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', default=5))
+DATABASE_ROUTERS = ['emenu.db.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    # The public responses and the versions which evict them. Only a cache shared by
+    # the web, Celery and management command processes, e.g. memcached, is evicted for
+    # all of them, so the deploy checks warn about a local one when DEBUG is off.
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', default='emenu'),
+    },
+    # The request counters of the rate limits. Only a cache shared by the worker
+    # processes, e.g. memcached, limits the requests to all of them together.
+    'throttle': {
+        'BACKEND': os.environ.get('THROTTLE_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('THROTTLE_CACHE_LOCATION', default='emenu-throttle'),
+    },
+}
+THROTTLE_CACHE_ALIAS = 'throttle'
+
+# Serve the public menu endpoints from values() rows instead of the DRF serializers.
+PUBLIC_FAST_SERIALIZATION = bool(
+    int(os.environ.get('PUBLIC_FAST_SERIALIZATION', default=True)))
+
+# Serve the public menu details from stored JSON snapshots, rebuilt by Celery on changes.
+PUBLIC_MENU_SNAPSHOTS = bool(
+    int(os.environ.get('PUBLIC_MENU_SNAPSHOTS', default=True)))
+
+PUBLIC_MENU_CACHE_ALIAS = 'default'
+PUBLIC_MENU_CACHE_TIMEOUT = int(
+    os.environ.get('PUBLIC_MENU_CACHE_TIMEOUT', default=300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -147,11 +235,40 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# The OpenAPI schema written by the build_openapi_schema command. Without it,
+# the schema is generated on the first request of every process. The file is
+# ignored by git and Docker, so a local build does not outlive code changes.
+OPENAPI_SCHEMA_FILE = os.environ.get(
+    'OPENAPI_SCHEMA_FILE', default=os.path.join(BASE_DIR, 'openapi-schema.json'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'emenu.menu.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.environ.get('API_PAGE_SIZE', default=50)),
+    'DEFAULT_RENDERER_CLASSES': [
+        'emenu.menu.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # The rate limits of the public endpoints, e.g. '10/s' or '600/min', per client
+    # and for all clients together. They are off when empty.
+    'DEFAULT_THROTTLE_RATES': {
+        'public-client': os.environ.get('PUBLIC_CLIENT_THROTTLE_RATE') or None,
+        'public-global': os.environ.get('PUBLIC_GLOBAL_THROTTLE_RATE') or None,
+    },
+    # The number of proxies in front of the app, which set X-Forwarded-For. Without
+    # proxies the header comes from the clients, so they are told apart by REMOTE_ADDR.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', default=0)),
+}
+
+# MessagePack responses (Accept: application/msgpack) need the optional msgpack package.
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append(
+        'emenu.menu.renderers.MessagePackRenderer')
+
 
 def timezone_adjusted_now(): return datetime.datetime.now(pytz.timezone(TIME_ZONE))
 
@@ -168,6 +285,23 @@ CELERY_BEAT_SCHEDULE = {
     },
 }
 
+# Number of dish updates mails sent by one Celery subtask, over one mail connection.
+NEW_DISHES_MAIL_CHUNK_SIZE = int(
+    os.environ.get('NEW_DISHES_MAIL_CHUNK_SIZE', default=100))
+
+# Count all rows of the admin changelists. Turn it off when the catalog tables are large.
+ADMIN_FULL_COUNTS = bool(int(os.environ.get('ADMIN_FULL_COUNTS', default=True)))
+
+# The maximum number of change log entries read by one request to the change feed.
+CHANGE_FEED_PAGE_SIZE = int(
+    os.environ.get('CHANGE_FEED_PAGE_SIZE', default=500))
+
+# The seconds within which the transactions writing to the change log commit. The change
+# feed cursor and the digest watermark do not pass the younger entries, since an entry
+# with a lower id may still be committed among them.
+CHANGE_LOG_SAFETY_LAG = int(
+    os.environ.get('CHANGE_LOG_SAFETY_LAG', default=60))
+
 try:
     from emenu.local_settings import *
 except ImportError as e:
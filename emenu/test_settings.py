@@ -0,0 +1,11 @@
+"""
+Settings for the tests: python manage.py test --settings=emenu.test_settings
+"""
+from emenu.settings import *
+
+# The tests of the read replica routing fill a second database of their own. An SQLite
+# test database is kept in memory, so nothing is written to the disk.
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': ':memory:',
+}
@@ -18,13 +18,18 @@ from django.urls import include, path
 from django.views.generic import TemplateView
 from emenu.menu import views
 from rest_framework.routers import DefaultRouter, SimpleRouter
-from rest_framework.schemas import get_schema_view
 
 public_router = SimpleRouter()
 public_router.register(r'menu', views.PublicMenuViewSet,
                        basename='public-menu')
 public_router.register(r'menu', views.PublicMenuDetailsViewSet,
                        basename='public-menu')
+public_router.register(r'search/menus', views.PublicMenuSearchViewSet,
+                       basename='public-menu-search')
+public_router.register(r'search/dishes', views.PublicDishSearchViewSet,
+                       basename='public-dish-search')
+public_router.register(r'changes/menus', views.PublicMenuChangesViewSet,
+                       basename='public-menu-changes')
 
 private_router = SimpleRouter()
 private_router.register(
@@ -34,16 +39,12 @@ private_router.register(
 
 urlpatterns = [
     path('', views.api_root, name='root'),
+    path('private/export/', views.export_catalog, name='catalog-export'),
     path('private/', include(private_router.urls)),
     path('public/', include(public_router.urls)),
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
-    path('openapi/', get_schema_view(
-        title="eMenu API",
-        description="API for fetching and managing restaurant menu",
-        version="1.0.0",
-        public=True,
-    ), name='openapi-schema'),
+    path('openapi/', views.CachedSchemaView.as_view(), name='openapi-schema'),
     path('docs/', TemplateView.as_view(
         template_name='menu/swagger-ui.html',
         extra_context={'schema_url': 'openapi-schema'}